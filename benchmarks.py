@@ -0,0 +1,569 @@
+import collections
+import datetime
+import fractions
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from parkinglot import ParkingLot, ParkingTicket, TicketStore, VehicleType, PaymentMethod, PaymentStatus, Tariff, loadNumpy, defaultLayout
+from journal import EventJournal
+from fleet import FleetManager
+from gateserver import percentile
+from simulation import simulate
+from metrics import Metrics
+from reports import streamTickets, summarize, exportCSV, exportJSONL
+from reservations import ReservationBook
+from simulation import SimulatedClock, Simulator, panelsFor
+from pricing import DynamicPricing
+from payments import PaymentProcessor, FakeGateway
+
+def buildLot(numSpots: int, compact: bool):
+    #4 sections per floor; pick spots per section so the floor count stays reasonable.
+    spotsPerSection = 100 if numSpots <= 100000 else 1000
+    numFloors = numSpots // (4 * spotsPerSection)
+    return ParkingLot("Benchmark", "admin", "admin", numFloors=numFloors, spotsPerSection=spotsPerSection, maxFloors=numFloors, compact=compact)
+
+def memoryBenchmark(sizes=(10000, 1000000)):
+    print("Memory: object backend vs compact backend")
+    for numSpots in sizes:
+        for compact in (False, True):
+            tracemalloc.start()
+            start = time.perf_counter()
+            pl = buildLot(numSpots, compact)
+            untouched = tracemalloc.get_traced_memory()[0]
+            #Object-backend spots are created on first access; touch every one so both backends hold the whole lot.
+            for floor in pl.floors:
+                for section in floor.sections:
+                    for spot in section.spots:
+                        pass
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            spot = pl.allocator.allocate(VehicleType.CAR)
+            assert pl.floors[spot.floor - 1].sections[0].spots[spot.id - 1].isFree == False
+            backend = "compact" if compact else "object"
+            print(f"{pl.totalSpots:>9} spots  {backend:<8} {current / 1048576:8.2f} MiB  ({current / pl.totalSpots:6.1f} B/spot)  built and touched in {elapsed:.2f}s  (before touching: {untouched / 1048576:.2f} MiB)")
+            del pl
+
+def checkInvariants(pl: ParkingLot):
+    #Counters, bitmaps, isFree flags and open tickets must all agree.
+    numbers = [t.ticketNumber for t in pl.tickets]
+    assert len(numbers) == len(set(numbers)), "duplicate ticket numbers"
+    openSpots = [t.spot for t in pl.tickets.openTickets.values()]
+    assert len(openSpots) == len(set(openSpots)), "two open tickets share a spot"
+    #Counters and capacity cover open floors only; vehicles may still be parked on draining ones.
+    active = pl.allocator.active
+    totalFree = 0
+    for vt in VehicleType:
+        flags = sum(1 for fl, floor in enumerate(pl.floors) if active[fl] for section in floor.sections if section.vehicleType == vt for spot in section.spots if spot.isFree)
+        bits = sum(pl.allocator.spotMasks[fl][se].bit_count() for fl, floor in enumerate(pl.floors) if active[fl] for se, section in enumerate(floor.sections) if section.vehicleType == vt)
+        assert flags == bits == pl.freeSpots(vt), f"{vt.name}: flags {flags}, bits {bits}, counter {pl.freeSpots(vt)}"
+        capacity = sum(len(section.spots) for fl, floor in enumerate(pl.floors) if active[fl] for section in floor.sections if section.vehicleType == vt)
+        assert capacity == pl.capacity(vt), f"{vt.name}: {capacity} spots, capacity {pl.capacity(vt)}"
+        totalFree += flags
+    draining = sum(1 for fl, floor in enumerate(pl.floors) if not active[fl] for section in floor.sections for spot in section.spots if not spot.isFree)
+    assert pl.totalSpots - totalFree + draining == pl.tickets.numOpen(), "occupied spots do not match open tickets"
+    for ticket in pl.tickets.openTickets.values():
+        fl, se, sp = ticket.spotIndex
+        assert pl.floors[fl].sections[se].spots[sp].isFree == False, f"open ticket {ticket.ticketNumber} points at a free spot"
+
+def stressBenchmark(numEntrances=16, numExits=16, opsPerGate=2000, seed=1):
+    #Entrance and exit gates hammer one lot from separate threads; exits pick ticket numbers from a
+    #shared pool, so several gates regularly race to pay the same ticket.
+    print("Stress: concurrent entrance/exit gates")
+    pl = ParkingLot("Stress", "admin", "admin", numFloors=8, spotsPerSection=50)
+    issued = []
+    paid = []
+    previousInterval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def entrance(gate: int):
+        rng = random.Random(seed * 1000 + gate)
+        for _ in range(opsPerGate):
+            result = pl.issueTicket(rng.randint(1, 4), rng.random() < 0.1)
+            if result.ok:
+                issued.append(result.ticket.ticketNumber)
+
+    def exit(gate: int):
+        rng = random.Random(seed * 2000 + gate)
+        for _ in range(opsPerGate):
+            if issued:
+                result = pl.checkout(issued[rng.randrange(len(issued))], PaymentMethod.CARD)
+                if result.ok:
+                    paid.append(result.ticket.ticketNumber)
+
+    threads = [threading.Thread(target=entrance, args=(i,)) for i in range(numEntrances)]
+    threads += [threading.Thread(target=exit, args=(i,)) for i in range(numExits)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    sys.setswitchinterval(previousInterval)
+
+    assert len(paid) == len(set(paid)), "a ticket was paid twice"
+    assert len(paid) == len(pl.tickets.archivedTickets)
+    checkInvariants(pl)
+    ops = (numEntrances + numExits) * opsPerGate
+    print(f"{len(threads)} gates, {len(issued)} tickets issued, {len(paid)} paid, {ops / elapsed:,.0f} ops/s, invariants hold")
+
+def journalBenchmark(numEvents=2000000, openTickets=50000):
+    #Drives issue/checkout cycles through a journaled lot, then times recovery from the full log and
+    #from a snapshot plus a 10% tail.
+    print("Journal: write throughput and recovery")
+    directory = tempfile.mkdtemp(prefix="parkinglot-journal-")
+    try:
+        def newLot():
+            return ParkingLot("Journal", "admin", "admin", numFloors=25, spotsPerSection=1000, maxFloors=25, compact=True)
+
+        def drive(pl: ParkingLot, journal: EventJournal, untilSeq: int, open: collections.deque):
+            start = time.perf_counter()
+            first = journal.seq
+            while journal.seq < untilSeq:
+                result = pl.issueTicket(journal.seq % 4 + 1, False)
+                if result.ok:
+                    open.append(result.ticket.ticketNumber)
+                if len(open) > openTickets or not result.ok:
+                    pl.checkout(open.popleft())
+            journal.sync()
+            elapsed = time.perf_counter() - start
+            return (journal.seq - first) / elapsed
+
+        pl = newLot()
+        journal = EventJournal(directory)
+        journal.restore(pl)
+        open = collections.deque()
+        rate = drive(pl, journal, numEvents, open)
+        journal.close()
+        print(f"{numEvents:,} events written at {rate:,.0f} events/s (issue/checkout included)")
+
+        start = time.perf_counter()
+        pl = newLot()
+        journal = EventJournal(directory)
+        journal.restore(pl)
+        print(f"recovery from the full log: {time.perf_counter() - start:.2f}s, {pl.tickets.numOpen():,} open tickets")
+
+        start = time.perf_counter()
+        journal.snapshot()
+        print(f"snapshot of {len(pl.tickets):,} tickets: {time.perf_counter() - start:.2f}s")
+        open = collections.deque(sorted(pl.tickets.openTickets))
+        drive(pl, journal, journal.seq + numEvents // 10, open)
+        journal.close()
+
+        start = time.perf_counter()
+        pl = newLot()
+        journal = EventJournal(directory)
+        journal.restore(pl)
+        print(f"recovery from snapshot + {numEvents // 10:,} event tail: {time.perf_counter() - start:.2f}s")
+        journal.close()
+    finally:
+        shutil.rmtree(directory)
+
+def tariffBenchmark(numStays=2000000, numOpen=50000, seed=1):
+    #Reprices a year of synthetic stays under a proposed tariff and projects revenue over the open tickets.
+    print(f"Tariff: bulk pricing ({'NumPy' if loadNumpy() is not None else 'pure Python, NumPy not installed'})")
+    rng = random.Random(seed)
+    seconds = [rng.expovariate(1 / 10800) for _ in range(numStays)]
+    fees = [rng.random() < 0.05 for _ in range(numStays)]
+    numpy = loadNumpy()
+    if numpy is not None:
+        seconds = numpy.array(seconds)
+        fees = numpy.array(fees)
+    current = Tariff()
+    proposed = Tariff(tiers=((1, 4.5), (2, 3.5), (5, 2)))
+    start = time.perf_counter()
+    before = current.revenue(seconds, fees)
+    after = proposed.revenue(seconds, fees)
+    elapsed = time.perf_counter() - start
+    print(f"{numStays:,} stays repriced twice in {elapsed * 1000:.0f} ms: {before:,.2f} -> {after:,.2f}")
+
+    pl = buildLot(numOpen * 2, True)
+    for i in range(numOpen):
+        pl.issueTicket(i % 4 + 1, False)
+    start = time.perf_counter()
+    revenue = pl.projectedRevenue()
+    print(f"projected revenue over {numOpen:,} open tickets: {revenue:,.2f} in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+def fleetBenchmark(maxWorkers: int = None, lotsPerWorker: int = 4, batchSize: int = 2000, rounds: int = 20):
+    #Fixed work per worker (issue + checkout cycles in batches); with linear scaling ops/s grows with
+    #the worker count.
+    if maxWorkers is None:
+        maxWorkers = os.cpu_count() or 1
+    print(f"Fleet: scaling across worker processes ({os.cpu_count()} cores)")
+    counts = sorted({1, 2, 4, 8, 16, maxWorkers} & set(range(1, maxWorkers + 1)))
+    base = None
+    for numWorkers in counts:
+        fleet = FleetManager(numWorkers)
+        locations = []
+        i = 0
+        while len(locations) < numWorkers * lotsPerWorker:
+            location = f"Site {i}"
+            i += 1
+            if sum(1 for l in locations if fleet.workerFor(l) == fleet.workerFor(location)) < lotsPerWorker:
+                fleet.addLot(location, "admin", "admin", numFloors=20, spotsPerSection=100, maxFloors=20, compact=True)
+                locations.append(location)
+        ops = 0
+        start = time.perf_counter()
+        for r in range(rounds):
+            issued = fleet.submit([("issue", (locations[j % len(locations)], j % 4 + 1, False, None)) for j in range(batchSize * numWorkers)])
+            checkouts = [("checkout", (locations[j % len(locations)], reply["ticketNumber"], 1)) for j, reply in enumerate(issued) if reply["ok"]]
+            fleet.submit(checkouts)
+            ops += len(issued) + len(checkouts)
+        elapsed = time.perf_counter() - start
+        fleet.close()
+        rate = ops / elapsed
+        if base is None:
+            base = rate
+        print(f"{numWorkers:>3} workers: {rate:>10,.0f} ops/s  ({rate / base:.2f}x)")
+
+def simulationBenchmark(sizes=(200, 10000, 100000, 1000000), maxEvents: int = 200000, seed: int = 1):
+    #Deterministic simulated traffic at several lot sizes. Simulated time is fixed by the seed; the
+    #reported rates and latencies are wall clock for the library calls only.
+    print("Simulation: seeded Poisson arrivals, latencies per operation and per panel")
+    for numSpots in sizes:
+        start = time.perf_counter()
+        simulator = simulate(numSpots, seed=seed, maxEvents=maxEvents)
+        elapsed = time.perf_counter() - start
+        ops = sum(len(samples) for samples in simulator.latencies.values())
+        busy = sum(sum(samples) for samples in simulator.latencies.values())
+        print(f"{simulator.pl.totalSpots:>9,} spots: {ops:,} ops, {ops / busy:>10,.0f} ops/s in calls ({elapsed:.1f}s total, {simulator.rejected:,} turned away)")
+        for op, samples in simulator.latencies.items():
+            print(f"    {op:<9} p50 {percentile(samples, 0.50) * 1e6:9.1f} us  p99 {percentile(samples, 0.99) * 1e6:9.1f} us")
+        simulated = max((simulator.clock.now - simulator.started).total_seconds(), 1)
+        for panels in (simulator.entrancePanels, simulator.exitPanels):
+            waits = [wait for panel in panels for wait in panel.waits]
+            busiest = max(panels, key=lambda panel: panel.served)
+            p99s = [percentile(panel.latencies, 0.99) * 1e6 for panel in panels if panel.latencies]
+            print(f"    {len(panels)} {panels[0].kind} panels, {sum(panel.busySeconds for panel in panels) / simulated / len(panels):4.0%} busy, "
+                  f"queue wait p50 {percentile(waits, 0.5):5.1f} s  p99 {percentile(waits, 0.99):6.1f} s, "
+                  f"per-panel call p99 {min(p99s, default=0):.1f}-{max(p99s, default=0):.1f} us, busiest #{busiest.id} ({busiest.served:,} vehicles)")
+
+def metricsBenchmark(cycles: int = 200000):
+    #Cost of the instrumentation on the gate API: the same issue + checkout cycles with the lot plain,
+    #instrumented, and instrumented with the sampling profiler running.
+    print("Metrics: gate cycle cost with instrumentation off and on")
+    pl = buildLot(10000, False)
+    metrics = Metrics()
+    base = None
+    for mode in ("off", "on", "profiler"):
+        if mode == "on":
+            metrics.instrument(pl)
+        elif mode == "profiler":
+            metrics.startProfiler()
+        start = time.perf_counter()
+        for i in range(cycles):
+            result = pl.issueTicket(i % 4 + 1, False)
+            pl.checkout(result.ticket.ticketNumber)
+        elapsed = time.perf_counter() - start
+        perCycle = elapsed / cycles * 1e6
+        if base is None:
+            base = perCycle
+        print(f"{mode:>9}: {perCycle:6.2f} us/cycle  (+{perCycle - base:5.2f} us)")
+    metrics.stopProfiler()
+    metrics.uninstrument(pl)
+    print(f"{len(metrics.render().splitlines())} exported lines")
+
+def reportsBenchmark(days: int = 365, ticketsPerDay: int = 3000, seed: int = 1):
+    #A year of history in an in-memory store, then one-pass aggregation and CSV/JSONL export.
+    #Peak memory is traced over the export only, i.e. what the pipeline itself allocates.
+    print(f"Reports: streaming {days * ticketsPerDay:,} tickets")
+    rng = random.Random(seed)
+    store = TicketStore()
+    first = 1704067200.0
+    tickets = []
+    for i in range(days * ticketsPerDay):
+        issuedAt = first + i * 86400 / ticketsPerDay
+        paidAt = issuedAt + rng.expovariate(1 / 9000)
+        tickets.append(ParkingTicket.restore(i + 1, i % 4 + 1, False, "1A1", issuedAt, rng.random() < 0.1, paidAt, rng.choice((0, 4, 7.5, 11))))
+    store.load(tickets)
+    del tickets
+    start = time.perf_counter()
+    summary = summarize(streamTickets(store))
+    print(f"summary:     {time.perf_counter() - start:6.2f}s  ${summary.revenue:,.2f}, average stay {summary.averageDwell() / 3600:.2f} h")
+    start = time.perf_counter()
+    summary = summarize(streamTickets(store, vehicleType=VehicleType.TRUCK, additionalFee=True))
+    print(f"filtered:    {time.perf_counter() - start:6.2f}s  {summary.tickets:,} trucks with additional fee")
+    directory = tempfile.mkdtemp(prefix="parkinglot-reports-")
+    try:
+        for name, export in (("csv", exportCSV), ("jsonl", exportJSONL)):
+            path = os.path.join(directory, "tickets." + name)
+            start = time.perf_counter()
+            count = export(streamTickets(store), path)
+            elapsed = time.perf_counter() - start
+            print(f"{name + ':':<12} {elapsed:6.2f}s  {count / elapsed:,.0f} rows/s, {os.path.getsize(path) / 2**20:,.0f} MiB")
+        tracemalloc.start()
+        count = exportCSV(streamTickets(store, status=PaymentStatus.COMPLETED), os.path.join(directory, "paid.csv"))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"export peak memory: {peak / 2**20:.1f} MiB for {count:,} rows")
+    finally:
+        shutil.rmtree(directory)
+
+def reservationsBenchmark(numSpots: int = 100000, numBookings: int = 100000, queries: int = 20000, seed: int = 1):
+    #Books a week of random 1-8 hour windows, then times availability queries of the kind
+    #"any van spot free from 14:00 to 18:00 on floor <= 3" against the slot index.
+    print(f"Reservations: {numBookings:,} bookings on {numSpots:,} spots")
+    rng = random.Random(seed)
+    clock = SimulatedClock(datetime.datetime(2024, 1, 1))
+    spotsPerSection = 1000
+    numFloors = numSpots // (4 * spotsPerSection)
+    pl = ParkingLot("Reservations", "admin", "admin", numFloors=numFloors, spotsPerSection=spotsPerSection, maxFloors=numFloors, compact=True, clock=clock)
+    book = ReservationBook(pl)
+    def window():
+        start = clock.now + datetime.timedelta(days=1, hours=rng.randrange(7 * 24))
+        return start, start + datetime.timedelta(hours=rng.randint(1, 8))
+    booked = 0
+    start = time.perf_counter()
+    for i in range(numBookings):
+        begin, end = window()
+        if book.book(rng.randint(1, 4), begin, end, maxFloor=rng.randint(1, numFloors)) is not None:
+            booked += 1
+    elapsed = time.perf_counter() - start
+    print(f"book:  {numBookings / elapsed:10,.0f} bookings/s ({booked:,} succeeded)")
+    latencies = []
+    found = 0
+    for i in range(queries):
+        begin, end = window()
+        start = time.perf_counter()
+        if book.find(VehicleType.VAN, begin, end, maxFloor=3) is not None:
+            found += 1
+        latencies.append(time.perf_counter() - start)
+    print(f"find:  p50 {percentile(latencies, 0.50) * 1e6:7.1f} us  p99 {percentile(latencies, 0.99) * 1e6:7.1f} us ({found:,}/{queries:,} found)")
+
+def tokensBenchmark(numTickets: int = 50000):
+    #Signed ticket codes: verification one by one and in batches, and the exit path by code versus by number.
+    print(f"Tokens: {numTickets:,} ticket codes")
+    pl = buildLot(100000, True)
+    tokens = [pl.issueTicket(i % 4 + 1, False).ticket.token for i in range(numTickets)]
+    start = time.perf_counter()
+    for token in tokens:
+        pl.codec.decode(token)
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    pl.codec.decodeMany(tokens)
+    batch = time.perf_counter() - start
+    print(f"verify one by one: {numTickets / single:10,.0f} codes/s")
+    print(f"verify in batch:   {numTickets / batch:10,.0f} codes/s")
+    half = numTickets // 2
+    start = time.perf_counter()
+    for result in pl.checkoutTokens(tokens[:half]):
+        assert result.ok
+    byToken = time.perf_counter() - start
+    numbers = [pl.codec.decode(token)[0] for token in tokens[half:]]
+    start = time.perf_counter()
+    for number in numbers:
+        assert pl.checkout(number).ok
+    byNumber = time.perf_counter() - start
+    print(f"checkout by code:   {half / byToken:9,.0f} exits/s")
+    print(f"checkout by number: {half / byNumber:9,.0f} exits/s")
+    checkInvariants(pl)
+
+def checkPricingBoundaries(capacities=(1, 7, 10, 100, 333, 1000)):
+    #Fills a one-section lot spot by spot. At every free count, an engine that followed the lot, a
+    #fresh engine and band() must agree with the band worked out exactly from the decimal thresholds,
+    #and a second lookup at the same count must not rebuild the table.
+    for capacity in capacities:
+        pl = ParkingLot("Bands", "admin", "admin", numFloors=1, layout=[(VehicleType.CAR, capacity)])
+        gradual = DynamicPricing(pl)
+        thresholds = [fractions.Fraction(str(start)) for start, multiplier in gradual.bands]
+        for occupied in range(capacity + 1):
+            expected = max(band for band, start in enumerate(thresholds) if fractions.Fraction(occupied, capacity) >= start)
+            fresh = DynamicPricing(pl)
+            pl.pricing = gradual
+            factor = gradual.factor(VehicleType.CAR)
+            rebuilds = gradual.rebuilds
+            assert gradual.factor(VehicleType.CAR) == factor and gradual.rebuilds == rebuilds, f"{capacity} spots, {occupied} occupied: table rebuilt again"
+            assert factor == fresh.factor(VehicleType.CAR), f"{capacity} spots, {occupied} occupied: cached {factor}, fresh {fresh.factor(VehicleType.CAR)}"
+            assert gradual.band(VehicleType.CAR) == expected, f"{capacity} spots, {occupied} occupied: band {gradual.band(VehicleType.CAR)}, expected {expected}"
+            assert gradual.tables[VehicleType.CAR][3] == gradual.rebuild(VehicleType.CAR, pl.freeSpots(VehicleType.CAR)), f"{capacity} spots, {occupied} occupied: wrong band cached"
+            if occupied < capacity:
+                pl.issueTicket(VehicleType.CAR, False)
+
+def pricingBenchmark(numSpots: int = 10000, lookups: int = 1000000, seed: int = 1):
+    #Cost of a price-factor lookup, and how rarely the band tables are rebuilt under simulated traffic.
+    print("Pricing: occupancy-banded factors")
+    checkPricingBoundaries()
+    clock = SimulatedClock()
+    pl = buildLot(numSpots, False)
+    pl.clock = clock
+    pricing = DynamicPricing(pl)
+    start = time.perf_counter()
+    for i in range(lookups):
+        pricing.factor(VehicleType.CAR, clock.now)
+    elapsed = time.perf_counter() - start
+    print(f"factor lookup: {elapsed / lookups * 1e9:7.0f} ns")
+    arrivals = {vt: 60 * numSpots / 200 for vt in VehicleType}
+    simulator = Simulator(pl, clock, seed, arrivals, numPanels=panelsFor(arrivals), boardEvery=0)
+    simulator.run(datetime.timedelta(days=1), 500000)
+    factors = collections.Counter(round(t.priceFactor, 2) for t in pl.tickets)
+    print(f"{simulator.arrived:,} arrivals, {pricing.rebuilds} table rebuilds, factors used: {dict(sorted(factors.items()))}")
+
+def paymentsBenchmark(numGates: int = 64, exitsPerGate: int = 20, latency: float = 0.05):
+    #Card exits through a slow fake gateway: one request per gateway call versus batched calls. A cash
+    #gate runs alongside and must not be slowed down by the card gates waiting on the gateway.
+    print(f"Payments: {numGates} card gates, gateway latency {latency * 1000:.0f} ms")
+    for label, batchSize, concurrency in (("one at a time", 1, 1), ("batched", 50, 8)):
+        clock = SimulatedClock()
+        pl = buildLot(100000, True)
+        pl.clock = clock
+        gateway = FakeGateway(latency, declineRate=0, errorRate=0.01, seed=1)
+        processor = PaymentProcessor(pl, gateway, batchSize=batchSize, concurrency=concurrency)
+        numbers = [[pl.issueTicket(VehicleType.CAR, False).ticket.ticketNumber for i in range(exitsPerGate)] for gate in range(numGates + 1)]
+        clock.now += datetime.timedelta(hours=3)
+        cashLatencies = []
+        done = threading.Event()
+
+        def cardGate(gate: int):
+            for number in numbers[gate]:
+                assert pl.checkout(number, PaymentMethod.CARD).ok
+
+        def cashGate():
+            for number in numbers[numGates]:
+                start = time.perf_counter()
+                assert pl.checkout(number, PaymentMethod.CASH).ok
+                cashLatencies.append(time.perf_counter() - start)
+                if done.wait(0.001):
+                    break
+
+        threads = [threading.Thread(target=cardGate, args=(gate,)) for gate in range(numGates)]
+        cash = threading.Thread(target=cashGate)
+        start = time.perf_counter()
+        cash.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        cash.join()
+        processor.close()
+        assert gateway.charged == numGates * exitsPerGate, f"{gateway.charged} charges for {numGates * exitsPerGate} card exits"
+        print(f"{label:14} {numGates * exitsPerGate / elapsed:8,.0f} card exits/s, {gateway.batches:5,} gateway calls, "
+              f"cash exit p99 {percentile(cashLatencies, 0.99) * 1000:.2f} ms")
+        checkInvariants(pl)
+
+def topologyBenchmark(numGates: int = 8, seconds: float = 3, numSpots: int = 1000000):
+    #Gate latency while another thread keeps growing, draining and rebuilding floors, against the same
+    #gates on a lot that does not change; then the cost of adding and draining a floor on a large lot.
+    print("Topology: live floor changes")
+    layouts = (defaultLayout(50), defaultLayout(60) + ((VehicleType.CAR, 40),), ((VehicleType.MOTORCYCLE, 80),), ())
+    for label, reshaping in (("static lot", False), ("reshaping lot", True)):
+        pl = ParkingLot("Topology", "admin", "admin", numFloors=8, spotsPerSection=50, maxFloors=12)
+        stop = threading.Event()
+        latencies = []
+        changes = [0]
+
+        def gate(seed: int):
+            rng = random.Random(seed)
+            parked = []
+            samples = []
+            while not stop.is_set():
+                start = time.perf_counter()
+                if parked and rng.random() < 0.5:
+                    pl.checkout(parked.pop(rng.randrange(len(parked))))
+                else:
+                    result = pl.issueTicket(rng.randint(1, 4), False)
+                    if result.ok:
+                        parked.append(result.ticket.ticketNumber)
+                samples.append(time.perf_counter() - start)
+            for number in parked:
+                pl.checkout(number)
+            latencies.extend(samples)
+
+        def admin():
+            rng = random.Random(0)
+            while not stop.is_set():
+                pl.setFloorLayout(rng.randint(1, 10), rng.choice(layouts))
+                changes[0] += 1
+                time.sleep(0.001)
+
+        threads = [threading.Thread(target=gate, args=(i,)) for i in range(numGates)]
+        if reshaping:
+            threads.append(threading.Thread(target=admin))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        checkInvariants(pl)
+        print(f"{label:14} {len(latencies) / seconds:9,.0f} ops/s  p50 {percentile(latencies, 0.5) * 1e6:6.1f} us  p99 {percentile(latencies, 0.99) * 1e6:7.1f} us  {changes[0]:,} floor changes")
+    pl = buildLot(numSpots, True)
+    pl.maxFloors += 1
+    start = time.perf_counter()
+    pl.addParkingFloor()
+    added = time.perf_counter() - start
+    start = time.perf_counter()
+    pl.removeParkingFloor(len(pl.floors))
+    removed = time.perf_counter() - start
+    print(f"{pl.totalSpots:,}-spot lot: add a floor {added * 1000:.2f} ms, drain and remove it {removed * 1000:.2f} ms")
+
+COLD_START = """
+import sys, time
+start = time.perf_counter()
+from parkinglot import ParkingLot
+imported = time.perf_counter()
+pl = ParkingLot("Cold", "admin", "admin", numFloors={numFloors}, spotsPerSection={spotsPerSection}, maxFloors={numFloors}, compact={compact})
+built = time.perf_counter()
+heavy = [name for name in ("re", "hashlib", "base64", "json", "http.server", "multiprocessing") if name in sys.modules]
+print(imported - start, built - imported, pl.totalSpots, ",".join(heavy) or "-")
+"""
+
+def coldstartBenchmark(numSpots: int = 100000, runs: int = 15):
+    #Import plus construction of a lot, each run in a fresh interpreter as a short-lived worker would.
+    #Bytecode is cached by a first run, as it is on a deployed worker. Importing must print nothing and
+    #pull in none of the heavy modules listed.
+    print(f"Cold start: import parkinglot and build a {numSpots:,}-spot lot in a new process")
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["PYTHONPATH"] = os.path.dirname(os.path.abspath(__file__))
+    spotsPerSection = 100
+    numFloors = numSpots // (4 * spotsPerSection)
+    for compact in (False, True):
+        code = COLD_START.format(numFloors=numFloors, spotsPerSection=spotsPerSection, compact=compact)
+        imports, builds, walls = [], [], []
+        for i in range(runs + 1):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout
+            wall = time.perf_counter() - start
+            imported, built, totalSpots, heavy = output.split()
+            if i == 0:
+                continue
+            imports.append(float(imported))
+            builds.append(float(built))
+            walls.append(wall)
+        backend = "compact" if compact else "object"
+        print(f"{backend:<8} import {percentile(imports, 0.5) * 1000:5.2f} ms  construct {percentile(builds, 0.5) * 1000:5.2f} ms  "
+              f"({int(totalSpots):,} spots)  whole process {percentile(walls, 0.5) * 1000:5.1f} ms  heavy modules loaded: {heavy}")
+    start = time.perf_counter()
+    for i in range(runs):
+        subprocess.run([sys.executable, "-c", "pass"], env=env, check=True)
+    print(f"bare interpreter startup {(time.perf_counter() - start) / runs * 1000:5.1f} ms")
+
+BENCHMARKS = {
+    "memory": memoryBenchmark,
+    "stress": stressBenchmark,
+    "journal": journalBenchmark,
+    "tariff": tariffBenchmark,
+    "fleet": fleetBenchmark,
+    "simulation": simulationBenchmark,
+    "metrics": metricsBenchmark,
+    "reports": reportsBenchmark,
+    "reservations": reservationsBenchmark,
+    "tokens": tokensBenchmark,
+    "pricing": pricingBenchmark,
+    "payments": paymentsBenchmark,
+    "topology": topologyBenchmark,
+    "coldstart": coldstartBenchmark,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
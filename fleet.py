@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+import threading
+import zlib
+from parkinglot import ParkingLot, VehicleType, PaymentMethod
+
+#Each worker process owns a set of lots keyed by location and answers messages on its pipe.
+#A message is a list of (op, args) requests and the reply is the list of results, so a caller can
+#send many requests for the same worker in one round trip.
+
+def handleRequest(lots: dict, op: str, args: tuple):
+    if op == "addLot":
+        location, admin, password, options = args
+        lots[location] = ParkingLot(location, admin, password, **options)
+        return {"ok": True}
+    if op == "freeSpots":
+        totals = {vt.name: 0 for vt in VehicleType}
+        for pl in lots.values():
+            for vt in VehicleType:
+                totals[vt.name] += pl.freeSpots(vt)
+        return totals
+    pl = lots.get(args[0])
+    if pl is None:
+        return {"ok": False, "status": "UNKNOWN_LOT"}
+    if op == "issue":
+        result = pl.issueTicket(*args[1:])
+        reply = {"ok": result.ok, "status": result.status.name}
+        if result.ok:
+            reply["ticketNumber"] = result.ticket.ticketNumber
+            reply["spot"] = result.ticket.spot
+        return reply
+    if op == "checkout":
+        result = pl.checkout(args[1], PaymentMethod(args[2]))
+        return {"ok": result.ok, "status": result.status.name, "amount": result.amount}
+    return {"ok": False, "status": "BAD_REQUEST"}
+
+def safeRequest(lots: dict, request):
+    #A request that raises is answered as BAD_REQUEST; the worker, and every lot it holds, keeps running.
+    try:
+        op, args = request
+        return handleRequest(lots, op, args)
+    except Exception as error:
+        return {"ok": False, "status": "BAD_REQUEST", "error": f"{type(error).__name__}: {error}"}
+
+def workerMain(connection):
+    lots = {}
+    while True:
+        requests = connection.recv()
+        if requests is None:
+            break
+        connection.send([safeRequest(lots, request) for request in requests])
+    connection.close()
+
+class FleetManager():
+    def __init__(self, numWorkers: int = None):
+        if numWorkers is None:
+            numWorkers = os.cpu_count() or 1
+        self.connections = []
+        self.locks = []
+        self.workers = []
+        for i in range(numWorkers):
+            parentEnd, childEnd = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=workerMain, args=(childEnd,), daemon=True)
+            worker.start()
+            childEnd.close()
+            self.connections.append(parentEnd)
+            self.locks.append(threading.Lock())
+            self.workers.append(worker)
+
+    def workerFor(self, location: str):
+        #Stable across runs, unlike hash() on strings.
+        return zlib.crc32(location.encode()) % len(self.workers)
+
+    def call(self, worker: int, requests: list):
+        with self.locks[worker]:
+            self.connections[worker].send(requests)
+            return self.connections[worker].recv()
+
+    def addLot(self, location: str, admin: str, password: str, **options):
+        return self.call(self.workerFor(location), [("addLot", (location, admin, password, options))])[0]
+
+    def issueTicket(self, location: str, vehicleType, pet: bool, spot: str = None):
+        return self.call(self.workerFor(location), [("issue", (location, VehicleType(vehicleType).value, pet, spot))])[0]
+
+    def checkout(self, location: str, ticketNumber: int, paymentMethod: PaymentMethod = PaymentMethod.CARD):
+        return self.call(self.workerFor(location), [("checkout", (location, ticketNumber, PaymentMethod(paymentMethod).value))])[0]
+
+    def submit(self, requests: list):
+        #Routes many ("issue" | "checkout", args) requests at once, args starting with the location.
+        #Each worker gets its share in one message and all workers run in parallel; results come back
+        #in request order.
+        batches = {}
+        for index, (op, args) in enumerate(requests):
+            batches.setdefault(self.workerFor(args[0]), []).append((index, (op, args)))
+        return self.scatter(batches, len(requests))
+
+    def scatter(self, batches: dict, size: int):
+        #batches maps worker -> [(result index, request)]. Sends every batch before waiting for any reply.
+        workers = sorted(batches)
+        for worker in workers:
+            self.locks[worker].acquire()
+        try:
+            for worker in workers:
+                self.connections[worker].send([request for index, request in batches[worker]])
+            results = [None] * size
+            for worker in workers:
+                replies = self.connections[worker].recv()
+                for (index, request), reply in zip(batches[worker], replies):
+                    results[index] = reply
+        finally:
+            for worker in workers:
+                self.locks[worker].release()
+        return results
+
+    def freeSpotsByType(self):
+        #Scatter-gather: every worker totals its own lots, then the totals are summed here.
+        batches = {worker: [(worker, ("freeSpots", ()))] for worker in range(len(self.workers))}
+        totals = {vt.name: 0 for vt in VehicleType}
+        for reply in self.scatter(batches, len(self.workers)):
+            for name, count in reply.items():
+                totals[name] += count
+        return totals
+
+    def close(self):
+        for worker, connection in enumerate(self.connections):
+            with self.locks[worker]:
+                connection.send(None)
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import json
+import time
+from parkinglot import ParkingLot, VehicleType, PaymentMethod, Payment, GateStatus
+from metrics import METRICS
+from payments import PaymentProcessor, FakeGateway
+from topology import Topology
+
+#Protocol: one JSON object per line in each direction.
+#  {"op": "issue", "vehicleType": 1, "pet": false, "spot": null}
+#  {"op": "checkout", "ticketNumber": 7, "paymentMethod": 1}
+#  {"op": "freeSpots"}
+#Every reply has "ok" and "status" (a GateStatus name, or "BAD_REQUEST").
+
+class GateServer():
+    def __init__(self, pl: ParkingLot, paymentDelay: float = 0):
+        self.pl = pl
+        self.paymentDelay = paymentDelay
+        self.connections = 0
+
+    async def collectPayment(self, ticket, payment: Payment):
+        #Waits for the card reader or cash acceptor (paymentDelay stands in for it), then for the card
+        #authorization if the lot has a payment processor. Either wait only suspends this connection,
+        #every other gate keeps being served.
+        if self.paymentDelay > 0:
+            await asyncio.sleep(self.paymentDelay)
+        if self.pl.payments is None or payment.method != PaymentMethod.CARD or payment.amount <= 0:
+            return True
+        return await asyncio.wrap_future(self.pl.payments.authorize(ticket.ticketNumber, payment.amount))
+
+    async def handle(self, request: dict):
+        if not isinstance(request, dict):
+            return {"ok": False, "status": "BAD_REQUEST"}
+        op = request.get("op")
+        if op == "issue":
+            spot = request.get("spot")
+            if spot is not None and not isinstance(spot, str):
+                return {"ok": False, "status": "BAD_REQUEST"}
+            result = self.pl.issueTicket(request["vehicleType"], bool(request.get("pet", False)), spot)
+            reply = {"ok": result.ok, "status": result.status.name}
+            if result.ok:
+                reply["ticketNumber"] = result.ticket.ticketNumber
+                reply["spot"] = result.ticket.spot
+                reply["issuedAtDate"] = result.ticket.issuedAtDate.isoformat()
+            return reply
+        if op == "checkout":
+            #Through the lot's checkout, so pricing, settlement and metrics are the same as at any other gate.
+            result = await self.pl.checkoutAsync(request["ticketNumber"], request.get("paymentMethod", 1), self.collectPayment)
+            if not result.ok:
+                return {"ok": False, "status": result.status.name}
+            return {"ok": True, "status": GateStatus.OK.name, "amount": result.amount}
+        if op == "freeSpots":
+            return {"ok": True, "status": GateStatus.OK.name, "freeSpots": {vt.name: self.pl.freeSpots(vt) for vt in VehicleType}}
+        return {"ok": False, "status": "BAD_REQUEST"}
+
+    async def serveConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = await self.handle(json.loads(line))
+                except Exception:
+                    #Whatever a malformed request trips over, the gate gets an answer and keeps its connection.
+                    reply = {"ok": False, "status": "BAD_REQUEST"}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except ConnectionResetError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765, unixPath: str = None):
+        if unixPath is not None:
+            return await asyncio.start_unix_server(self.serveConnection, path=unixPath)
+        return await asyncio.start_server(self.serveConnection, host, port)
+
+class GateClient():
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host: str = "127.0.0.1", port: int = 8765, unixPath: str = None):
+        if unixPath is not None:
+            reader, writer = await asyncio.open_unix_connection(unixPath)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, message: dict):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+def percentile(samples: list, p: float):
+    if not samples:
+        return 0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+async def loadGenerator(numPanels: int, cyclesPerPanel: int, host: str = "127.0.0.1", port: int = 8765, unixPath: str = None):
+    #Each simulated panel pair opens one connection and repeats: issue a ticket, then check it out.
+    latencies = {"issue": [], "checkout": []}
+
+    async def panel(index: int):
+        client = await GateClient.connect(host, port, unixPath)
+        for cycle in range(cyclesPerPanel):
+            start = time.perf_counter()
+            entry = await client.request({"op": "issue", "vehicleType": (index + cycle) % 4 + 1, "pet": False})
+            latencies["issue"].append(time.perf_counter() - start)
+            if entry["ok"]:
+                start = time.perf_counter()
+                await client.request({"op": "checkout", "ticketNumber": entry["ticketNumber"], "paymentMethod": 1})
+                latencies["checkout"].append(time.perf_counter() - start)
+        await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(panel(i) for i in range(numPanels)))
+    elapsed = time.perf_counter() - start
+    total = len(latencies["issue"]) + len(latencies["checkout"])
+    print(f"{numPanels} panels, {total} requests in {elapsed:.2f}s: {total / elapsed:,.0f} req/s")
+    for op, samples in latencies.items():
+        print(f"  {op:<9} p50 {percentile(samples, 0.50) * 1000:7.2f} ms  p99 {percentile(samples, 0.99) * 1000:7.2f} ms")
+
+async def main(args):
+    server = None
+    if args.command in ("serve", "local"):
+        if args.topology:
+            pl = Topology.load(args.topology).build(args.location, "admin", args.password)
+        else:
+            pl = ParkingLot(args.location, "admin", args.password, numFloors=args.floors, spotsPerSection=args.spots, maxFloors=max(args.floors, 9))
+        if args.metrics_port:
+            METRICS.instrument(pl)
+            METRICS.serve(args.host, args.metrics_port)
+        if args.gateway_latency is not None:
+            PaymentProcessor(pl, FakeGateway(args.gateway_latency, declineRate=args.decline_rate, errorRate=args.error_rate))
+        gateServer = GateServer(pl, args.payment_delay)
+        server = await gateServer.start(args.host, args.port, args.unix)
+        print(f"Serving {pl.totalSpots} spots for {args.location}")
+    if args.command == "serve":
+        async with server:
+            await server.serve_forever()
+    else:
+        await loadGenerator(args.panels, args.cycles, args.host, args.port, args.unix)
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parking lot gate server and load generator.")
+    parser.add_argument("command", choices=["serve", "load", "local"], help="'local' starts a server and loads it in the same process")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="Unix socket path instead of TCP")
+    parser.add_argument("--location", default="Ensenada, Baja California")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--floors", type=int, default=5)
+    parser.add_argument("--spots", type=int, default=10, help="spots per section")
+    parser.add_argument("--topology", default=None, help="JSON topology config file (replaces --floors and --spots)")
+    parser.add_argument("--payment-delay", type=float, default=0, help="seconds each checkout waits for the simulated payment")
+    parser.add_argument("--gateway-latency", type=float, default=None, help="authorize card payments through a fake gateway with this latency (seconds)")
+    parser.add_argument("--decline-rate", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--metrics-port", type=int, default=0, help="serve Prometheus metrics on this port")
+    parser.add_argument("--panels", type=int, default=100, help="concurrent panel connections for the load generator")
+    parser.add_argument("--cycles", type=int, default=100, help="entry/exit cycles per panel")
+    asyncio.run(main(parser.parse_args()))
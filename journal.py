@@ -0,0 +1,197 @@
+import json
+import os
+import sys
+import threading
+from parkinglot import layoutState
+
+class EventJournal():
+    #Append-only journal of ParkingLot events plus periodic snapshots, all in one local directory.
+    #Events are one JSON array per line, [seq, kind, ...]. They are written to the current segment file
+    #and fsynced in batches: every batchSize events or every syncInterval seconds, whichever comes first.
+    #A snapshot records the full state at some seq S and starts a new segment; older segments are then
+    #deleted, so startup loads the snapshot and replays only the events after S.
+    def __init__(self, directory: str, batchSize: int = 1000, syncInterval: float = 0.05, snapshotEvery: int = 0):
+        self.directory = directory
+        self.batchSize = batchSize
+        self.syncInterval = syncInterval
+        self.snapshotEvery = snapshotEvery
+        self.snapshotPath = os.path.join(directory, "snapshot.json")
+        self.seq = 0
+        self.pending = 0
+        self.eventsSinceSnapshot = 0
+        self.file = None
+        self.pl = None
+        self.lock = threading.Lock()
+        #One snapshot at a time: the flusher's periodic ones and snapshot() calls share the temp file and
+        #delete the segments they cover, so they must not overlap or finish out of order.
+        self.snapshotLock = threading.Lock()
+        self.closed = threading.Event()
+        self.flusher = None
+        os.makedirs(directory, exist_ok=True)
+
+    def segments(self):
+        names = [name for name in os.listdir(self.directory) if name.startswith("events-") and name.endswith(".log")]
+        return [os.path.join(self.directory, name) for name in sorted(names)]
+
+    def openSegment(self):
+        path = os.path.join(self.directory, f"events-{self.seq + 1:012d}.log")
+        self.file = open(path, "ab", buffering=1 << 20)
+
+    def restore(self, pl):
+        #Loads the snapshot, folds the journal tail into it and builds a freshly constructed lot from
+        #the result in one pass, then starts journaling the lot.
+        state = {"seq": 0, "numFloors": 0, "ticketNumber": 0, "attendant": [pl.parkingAttendant.username, pl.parkingAttendant.password, pl.parkingAttendant.status], "tickets": []}
+        if os.path.exists(self.snapshotPath):
+            with open(self.snapshotPath, "rb") as f:
+                state = json.load(f)
+        tickets = {t[0]: t for t in state["tickets"]}
+        for path in self.segments():
+            with open(path, "rb") as f:
+                good = 0
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        break #Torn write at the end of the log: everything after it is lost.
+                    good += len(line)
+                    if event[0] > state["seq"]:
+                        self.fold(state, tickets, event)
+            if good < os.path.getsize(path):
+                os.truncate(path, good)
+        state["tickets"] = list(tickets.values())
+        pl.loadState(state)
+        self.seq = state["seq"]
+        self.openSegment()
+        self.pl = pl
+        pl.journal = self
+        #Floors whose layout the journal does not know yet (the lot was built from its own config) are
+        #recorded, so the journal can be restored into a lot built with any layout.
+        known = state.get("floors", [])
+        with pl.journalLock:
+            for fl, floor in enumerate(pl.floors):
+                if fl >= len(known) or known[fl] is None or known[fl][0] is None:
+                    pl.record("L", fl + 1, layoutState(floor.layout()))
+        self.flusher = threading.Thread(target=self.flushLoop, daemon=True)
+        self.flusher.start()
+        return pl
+
+    def fold(self, state: dict, tickets: dict, event: list):
+        #Applies one event to the snapshot-shaped state. Ticket rows are
+        #[number, vehicleType, pet, spot, issuedAt, additionalFee, paidAt, payAmount, priceFactor, payStatus, payMethod],
+        #payStatus None meaning whatever paidAt implies (unpaid or completed).
+        state["seq"] = event[0]
+        kind = event[1]
+        if kind == "I":
+            #Journals written before price factors existed have no factor: those tickets pay the plain tariff.
+            tickets[event[2]] = [event[2], event[3], event[4], event[5], event[6], False, None, 0, event[7] if len(event) > 7 else 1.0, None, None]
+            state["ticketNumber"] = max(state["ticketNumber"], event[2])
+        elif kind == "F":
+            tickets[event[2]][5] = event[3]
+        elif kind == "P":
+            tickets[event[2]][6] = event[4]
+            tickets[event[2]][7] = event[3]
+            tickets[event[2]][9] = "COMPLETED"
+            #Journals written before payment methods were stored leave it unknown.
+            tickets[event[2]][10:] = [event[5] if len(event) > 5 else None]
+        elif kind == "C":
+            tickets[event[2]][6] = event[3]
+            tickets[event[2]][9] = "CANCELLED"
+        elif kind == "R":
+            tickets[event[2]][9] = "REFUNDED"
+        elif kind == "L":
+            if len(event) == 3:
+                #Journals written before floor layouts: floors were only added, all with the lot's layout.
+                state["numFloors"] = max(state["numFloors"], event[2])
+            else:
+                self.floorEntry(state, event[2])[:] = [event[3], None]
+        elif kind == "D":
+            self.floorEntry(state, event[2])[1] = event[3]
+        elif kind == "A":
+            state["attendant"] = event[2:5]
+
+    def floorEntry(self, state: dict, floorId: int):
+        #[layout, pending layout] of a floor in state["floors"], None layout meaning the lot's floor layout.
+        floors = state.setdefault("floors", [])
+        while len(floors) < max(floorId, state["numFloors"]):
+            floors.append(None)
+        if floors[floorId - 1] is None:
+            floors[floorId - 1] = [None, None]
+        state["numFloors"] = max(state["numFloors"], floorId)
+        return floors[floorId - 1]
+
+    def append(self, event):
+        #Caller holds the lot's journalLock, which keeps seq order equal to the order of state changes.
+        with self.lock:
+            self.seq += 1
+            self.file.write(json.dumps([self.seq, *event], separators=(",", ":")).encode() + b"\n")
+            self.pending += 1
+            self.eventsSinceSnapshot += 1
+            if self.pending >= self.batchSize:
+                self.syncLocked()
+
+    def sync(self):
+        with self.lock:
+            self.syncLocked()
+
+    def syncLocked(self):
+        if self.file is None:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def flushLoop(self):
+        #An error here (disk full, ...) is reported and retried next round; it must not end the timed fsyncs.
+        while not self.closed.wait(self.syncInterval):
+            try:
+                if self.pending:
+                    self.sync()
+                if self.snapshotEvery and self.eventsSinceSnapshot >= self.snapshotEvery:
+                    self.snapshot()
+            except Exception as error:
+                print(f"Journal: background flush failed, will retry: {type(error).__name__}: {error}", file=sys.stderr)
+
+    def snapshot(self):
+        #Captures the state under the lot's journalLock (gates wait only for the capture), then writes
+        #it out and drops the segments it covers, all under snapshotLock.
+        with self.snapshotLock:
+            self.snapshotLocked()
+
+    def snapshotLocked(self):
+        with self.pl.journalLock:
+            state = self.pl.snapshotState()
+            with self.lock:
+                state["seq"] = self.seq
+                self.syncLocked()
+                self.file.close()
+                covered = self.segments()
+                self.openSegment()
+                self.eventsSinceSnapshot = 0
+        temp = self.snapshotPath + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(json.dumps(state, separators=(",", ":")).encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.snapshotPath)
+        self.syncDirectory()
+        for path in covered:
+            os.remove(path)
+
+    def syncDirectory(self):
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        self.closed.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        with self.lock:
+            self.syncLocked()
+            self.file.close()
+            self.file = None
+        if self.pl is not None:
+            self.pl.journal = None
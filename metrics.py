@@ -0,0 +1,357 @@
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+from parkinglot import ParkingLot, EntrancePanel, ExitPanel, Payment, VehicleType, GateStatus
+
+#Instrumentation is attached from the outside: instrument() replaces the timed methods of one lot and
+#its panels with wrappers, uninstrument() puts the originals back. A lot that is not instrumented runs
+#the plain methods, so the layer costs nothing while it is off.
+
+#Histogram bucket upper bounds in seconds, 1-2.5-5 steps from 1us to 10s.
+BUCKETS = tuple(m * 10.0 ** e for e in range(-6, 1) for m in (1, 2.5, 5)) + (10.0,)
+
+#Panel methods timed per panel id, by panel class.
+PANEL_METHODS = {
+    EntrancePanel: ("printTicket", "correctSpotCode"),
+    ExitPanel: ("scanTicket",),
+}
+
+#checkoutTokens goes through the lot's checkoutToken, so each code is counted once.
+GATE_METHODS = (("issueTicket", "issue"), ("checkout", "checkout"), ("checkoutToken", "checkout"))
+#Entrances through a reservations.ReservationBook.
+RESERVATION_METHODS = (("checkIn", "issue"),)
+#Coroutine gate methods, used by the asyncio gate server.
+ASYNC_GATE_METHODS = (("checkoutAsync", "checkout"),)
+
+class Histogram():
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+
+class Counter():
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def add(self, amount: int = 1):
+        with self.lock:
+            self.value += amount
+
+#Payment.calculateAmountToPay is shared by every registry, so it is wrapped once while any registry has
+#lots instrumented, and each of those registries gets the timings in its own histogram.
+paymentOriginal = None
+paymentHistograms = ()
+paymentLock = threading.Lock()
+
+def timePayments(histogram: Histogram):
+    global paymentOriginal, paymentHistograms
+    with paymentLock:
+        paymentHistograms += (histogram,)
+        if paymentOriginal is not None:
+            return
+        original = paymentOriginal = Payment.calculateAmountToPay
+        perfCounter = time.perf_counter
+        def wrapper(*args, **kwargs):
+            start = perfCounter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = perfCounter() - start
+                for histogram in paymentHistograms:
+                    histogram.observe(elapsed)
+        Payment.calculateAmountToPay = wrapper
+
+def untimePayments(histogram: Histogram):
+    global paymentOriginal, paymentHistograms
+    with paymentLock:
+        paymentHistograms = tuple(h for h in paymentHistograms if h is not histogram)
+        if not paymentHistograms and paymentOriginal is not None:
+            Payment.calculateAmountToPay = paymentOriginal
+            paymentOriginal = None
+
+class Metrics():
+    #Registry of histograms and counters keyed by (name, labels), plus occupancy gauges that are read
+    #from the instrumented lots' freeSpots* counters only when metrics are rendered.
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lots = []
+        #Guards the registry dicts only; every histogram and counter has its own lock for updates.
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.closed = threading.Event()
+        self.exporters = []
+
+    def histogram(self, name: str, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            return self.histograms[key]
+
+    def counter(self, name: str, **labels):
+        return self.counterKey((name, tuple(sorted(labels.items()))))
+
+    def counterKey(self, key: tuple):
+        with self.lock:
+            if key not in self.counters:
+                self.counters[key] = Counter()
+            return self.counters[key]
+
+    def increment(self, name: str, amount: int = 1, **labels):
+        self.counter(name, **labels).add(amount)
+
+    def timed(self, function, histogram: Histogram):
+        perfCounter = time.perf_counter
+        def wrapper(*args, **kwargs):
+            start = perfCounter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(perfCounter() - start)
+        return wrapper
+
+    def timedGate(self, function, lot: str, op: str):
+        #Like timed(), and also counts the results by GateStatus.
+        histogram = self.histogram("parkinglot_gate_seconds", lot=lot, op=op)
+        counters = {status: self.counter("parkinglot_gate_results_total", lot=lot, op=op, status=status.name) for status in GateStatus}
+        perfCounter = time.perf_counter
+        def wrapper(*args, **kwargs):
+            start = perfCounter()
+            result = function(*args, **kwargs)
+            histogram.observe(perfCounter() - start)
+            counters[result.status].add()
+            return result
+        return wrapper
+
+    def timedGateAsync(self, function, lot: str, op: str):
+        #timedGate for a coroutine method; the time includes the awaits.
+        histogram = self.histogram("parkinglot_gate_seconds", lot=lot, op=op)
+        counters = {status: self.counter("parkinglot_gate_results_total", lot=lot, op=op, status=status.name) for status in GateStatus}
+        perfCounter = time.perf_counter
+        async def wrapper(*args, **kwargs):
+            start = perfCounter()
+            result = await function(*args, **kwargs)
+            histogram.observe(perfCounter() - start)
+            counters[result.status].add()
+            return result
+        return wrapper
+
+    def instrument(self, pl: ParkingLot):
+        if pl.metrics is self:
+            return
+        pl.metrics = self
+        self.lots.append(pl)
+        for name, op in GATE_METHODS:
+            setattr(pl, name, self.timedGate(getattr(pl, name), pl.location, op))
+        for name, op in ASYNC_GATE_METHODS:
+            setattr(pl, name, self.timedGateAsync(getattr(pl, name), pl.location, op))
+        self.instrumentPanels(pl)
+        self.instrumentReservations(pl)
+        if len(self.lots) == 1:
+            timePayments(self.histogram("parkinglot_payment_calculation_seconds"))
+
+    def instrumentPanels(self, pl: ParkingLot):
+        #Also called by the lot whenever it adds panels.
+        for panel in pl.entrancePanels + pl.exitPanels:
+            for name in PANEL_METHODS.get(type(panel), ()):
+                if name not in vars(panel):
+                    histogram = self.histogram("parkinglot_panel_seconds", lot=pl.location, panel=str(panel.id), op=name)
+                    setattr(panel, name, self.timed(getattr(panel, name), histogram))
+
+    def instrumentReservations(self, pl: ParkingLot):
+        #Also called by reservations.ReservationBook when it is attached to an instrumented lot.
+        book = pl.reservations
+        if book is None:
+            return
+        for name, op in RESERVATION_METHODS:
+            if name not in vars(book):
+                setattr(book, name, self.timedGate(getattr(book, name), pl.location, op))
+
+    def uninstrument(self, pl: ParkingLot):
+        if pl.metrics is not self:
+            return
+        for name, op in GATE_METHODS + ASYNC_GATE_METHODS:
+            vars(pl).pop(name, None)
+        for panel in pl.entrancePanels + pl.exitPanels:
+            for name in PANEL_METHODS.get(type(panel), ()):
+                vars(panel).pop(name, None)
+        if pl.reservations is not None:
+            for name, op in RESERVATION_METHODS:
+                vars(pl.reservations).pop(name, None)
+        pl.metrics = None
+        self.lots.remove(pl)
+        if not self.lots:
+            untimePayments(self.histogram("parkinglot_payment_calculation_seconds"))
+
+    def startProfiler(self, interval: float = 0.005, depth: int = 1):
+        if self.profiler is None:
+            self.profiler = SamplingProfiler(interval, depth)
+            self.profiler.start()
+        return self.profiler
+
+    def stopProfiler(self):
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.stop()
+            self.profiler = None
+        return profiler
+
+    def render(self):
+        #Prometheus text exposition format.
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        lastName = None
+        for (name, labels), histogram in histograms:
+            if name != lastName:
+                lines.append(f"# TYPE {name} histogram")
+                lastName = name
+            with histogram.lock:
+                counts = list(histogram.counts)
+                total = histogram.sum
+                count = histogram.count
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{formatLabels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{formatLabels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{formatLabels(labels)} {total!r}")
+            lines.append(f"{name}_count{formatLabels(labels)} {count}")
+        lastName = None
+        for (name, labels), counter in counters:
+            if name != lastName:
+                lines.append(f"# TYPE {name} counter")
+                lastName = name
+            lines.append(f"{name}{formatLabels(labels)} {counter.value}")
+        lines.append("# TYPE parkinglot_free_spots gauge")
+        for pl in self.lots:
+            for vt in VehicleType:
+                lines.append(f"parkinglot_free_spots{formatLabels((('lot', pl.location), ('vehicle_type', vt.name)))} {pl.freeSpots(vt)}")
+        lines.append("# TYPE parkinglot_total_spots gauge")
+        for pl in self.lots:
+            lines.append(f"parkinglot_total_spots{formatLabels((('lot', pl.location),))} {pl.totalSpots}")
+        lines.append("# TYPE parkinglot_open_tickets gauge")
+        for pl in self.lots:
+            lines.append(f"parkinglot_open_tickets{formatLabels((('lot', pl.location),))} {pl.tickets.numOpen()}")
+        profiler = self.profiler
+        if profiler is not None:
+            lines.append("# TYPE parkinglot_profile_samples_total counter")
+            frames = collections.Counter()
+            for stack, n in list(profiler.samples.items()):
+                frames[stack[0]] += n
+            for frame, n in frames.most_common(20):
+                lines.append(f"parkinglot_profile_samples_total{formatLabels((('frame', frame),))} {n}")
+        return "\n".join(lines) + "\n"
+
+    def writeFile(self, path: str):
+        #Written to a temporary file and renamed, so a scraper (e.g. node_exporter's textfile collector)
+        #never reads a half-written file.
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            f.write(self.render())
+        os.replace(temp, path)
+
+    def startFileExport(self, path: str, interval: float = 15):
+        def exportLoop():
+            while not self.closed.wait(interval):
+                self.writeFile(path)
+        exporter = threading.Thread(target=exportLoop, daemon=True)
+        exporter.start()
+        self.exporters.append(exporter)
+        return exporter
+
+    def serve(self, host: str = "127.0.0.1", port: int = 9464):
+        #HTTP endpoint for Prometheus to scrape; every path answers with the current metrics.
+        #http.server is imported only here: it is most of what importing this module would otherwise cost.
+        import http.server
+        metrics = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def close(self):
+        self.closed.set()
+        for exporter in self.exporters:
+            exporter.join()
+        self.stopProfiler()
+
+def formatLabels(labels: tuple):
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class SamplingProfiler():
+    #Every interval seconds, records where each other thread is: the innermost `depth` frames as
+    #"file:function:line" strings. Runs in its own thread and can be started and stopped at any time.
+    def __init__(self, interval: float = 0.005, depth: int = 1):
+        self.interval = interval
+        self.depth = depth
+        self.samples = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.samples[tuple(stack)] += 1
+
+    def top(self, n: int = 20):
+        return self.samples.most_common(n)
+
+    def printTop(self, n: int = 20):
+        total = sum(self.samples.values()) or 1
+        for stack, count in self.top(n):
+            print(f"{count / total * 100:5.1f}%  {' <- '.join(stack)}")
+
+#Process-wide default registry.
+METRICS = Metrics()
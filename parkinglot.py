@@ -1,5 +1,8 @@
 from enum import Enum
 import datetime
+import bisect
+import os
+import threading
 
 class VehicleType(Enum):
     CAR = 1
@@ -17,66 +20,1074 @@ class PaymentStatus(Enum):
     CANCELLED = 3
     REFUNDED = 4
 
+class PaymentMethod(Enum):
+    CARD = 1
+    CASH = 2
+
+class GateStatus(Enum):
+    OK = 1
+    LOT_FULL = 2
+    INVALID_SPOT = 3
+    WRONG_SECTION = 4
+    SPOT_OCCUPIED = 5
+    NO_UNPAID_TICKET = 6
+    NO_RESERVATION = 7
+    INVALID_TOKEN = 8
+    PAYMENT_DECLINED = 9
+
+class FloorPreference(Enum):
+    NEAREST = 1
+    FARTHEST = 2
+
+#Spot codes are floor number, section letters and spot number: 1B3, 12D140, 3AB7. Sections are
+#lettered A..Z, then AA, AB, ... like spreadsheet columns, so neither floors, sections nor spots have a limit.
+DIGITS = "0123456789"
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+def sectionName(se: int):
+    #0 = A, 25 = Z, 26 = AA.
+    name = ""
+    se += 1
+    while se > 0:
+        se, letter = divmod(se - 1, 26)
+        name = chr(65 + letter) + name
+    return name
+
+def sectionIndex(name: str):
+    if len(name) == 1:
+        return ord(name) - 65
+    se = 0
+    for letter in name:
+        se = se * 26 + ord(letter) - 64
+    return se - 1
+
+def parseSpotCode(spot: str):
+    #Change from human readable code to machine language code. Ex. 1B3 = (0, 1, 2). Returns None if malformed.
+    #Split by hand rather than with a regex, so importing the module does not load re.
+    rest = spot.lstrip(DIGITS)
+    number = rest.lstrip(LETTERS)
+    floor = spot[:len(spot) - len(rest)]
+    section = rest[:len(rest) - len(number)]
+    if not floor or not section or not number.isascii() or not number.isdigit():
+        return None
+    return int(floor) - 1, sectionIndex(section), int(number) - 1
+
+def spotIndex(spot):
+    #(floor, section, spot) indexes of a ParkingSpot or CompactSpot.
+    return spot.floor - 1, sectionIndex(spot.section), spot.id - 1
+
+def layoutState(layout: tuple):
+    #JSON-friendly form for snapshots and the journal: [[vehicle type value, spots], ...].
+    return [[vt.value, numSpots] for vt, numSpots in layout]
+
+def growsLayout(current: tuple, layout: tuple):
+    #True if layout only adds spots at the end of current's sections or sections after its last one.
+    if len(layout) < len(current):
+        return False
+    return all(vt == newVt and numSpots <= newSpots for (vt, numSpots), (newVt, newSpots) in zip(current, layout))
+
+def defaultLayout(spotsPerSection: int):
+    #The original floor: sections A, B, C and D for cars, trucks, vans and motorcycles.
+    return tuple((vt, spotsPerSection) for vt in VehicleType)
+
+def normalizeLayout(layout):
+    #A floor layout is a sequence of (vehicle type, number of spots), one per section in letter order.
+    #Vehicle types can be given as VehicleType, value or name.
+    return tuple((vt if isinstance(vt, VehicleType) else VehicleType[vt] if isinstance(vt, str) else VehicleType(vt), int(numSpots)) for vt, numSpots in layout)
+
+class NoLock():
+    #Stands in for a lock that is not needed.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NO_LOCK = NoLock()
+
+def lowestBit(mask: int):
+    return (mask & -mask).bit_length() - 1
+
+def highestBit(mask: int):
+    return mask.bit_length() - 1
+
 class ParkingLot:
-    def __init__(self, loc: str, admin: str, password: str):
-        self.totalSpots = 200
-        self.freeSpotsCars = 50
-        self.freeSpotsTrucks = 50
-        self.freeSpotsVans = 50
-        self.freeSpotsMotorcycles = 50
-        self.numEntrancePanels = 10
-        self.numExitPanels = 10
+    def __init__(self, loc: str, admin: str, password: str, numFloors: int = 5, spotsPerSection: int = 10, maxFloors: int = 9, compact: bool = False, ticketStore=None, tariff=None, clock=None, tokenKey: bytes = None, layout=None, panels: int = 10, panelsPerFloor: int = 2):
+        #The spot counters are filled in by the allocator as floors are registered.
+        self.totalSpots = 0
+        self.freeSpotsCars = 0
+        self.freeSpotsTrucks = 0
+        self.freeSpotsVans = 0
+        self.freeSpotsMotorcycles = 0
+        self.spotsPerSection = spotsPerSection
+        #Sections of every new floor as (vehicle type, spots) pairs; topology.Topology loads them from a config file.
+        self.floorLayout = normalizeLayout(layout) if layout is not None else defaultLayout(spotsPerSection)
+        self.maxFloors = maxFloors
+        self.panelsPerFloor = panelsPerFloor
+        #Floors being drained, by index, with the layout they get once empty (() removes the floor).
+        self.pendingLayouts = {}
+        self.tariff = tariff if tariff is not None else DEFAULT_TARIFF
+        #Every "now" the lot needs comes from here, so a simulation can drive time.
+        self.clock = clock if clock is not None else datetime.datetime.now
+        #Signs the ticket codes. Pass the same tokenKey on every start for codes to stay valid across restarts.
+        #The key is fixed here; the codec itself is built on first use (see codec).
+        self.tokenKey = tokenKey if tokenKey is not None else os.urandom(32)
+        self.ticketCodec = None
+        #With compact=True spot occupancy lives in one bytearray instead of one ParkingSpot object per spot.
+        self.grid = None
+        if compact:
+            self.grid = OccupancyGrid()
+        self.numEntrancePanels = panels
+        self.numExitPanels = panels
         self.location = loc #Add location when initialized
         self.admin = Admin(self, admin, password)
         self.parkingAttendant = ParkingAttendant(self, "", "")
 
-        self.entrancePanels = []
-        self.exitPanels = []
-        for i in range(1, 11):
-            self.entrancePanels.append(EntrancePanel(i, self))
-            self.exitPanels.append(ExitPanel(i, self))
+        #Panels, display boards and (without compact) spots are created the first time they are used.
+        self.entrancePanels = LazyList(lambda i: EntrancePanel(i + 1, self), panels)
+        self.exitPanels = LazyList(lambda i: ExitPanel(i + 1, self), panels)
 
         self.floors = []
-        for i in range(1, 6):
-            self.floors.append(ParkingFloor(i))
+        self.allocator = SpotAllocator(self)
+        for i in range(1, numFloors + 1):
+            self.floors.append(self.newFloor(i, self.floorLayout))
+        self.allocator.addFloors(self.floors)
 
         self.numParkingDisplayBoards = len(self.floors)
-        self.parkingDisplayBoards = []
-        for i in range(self.numParkingDisplayBoards):
-            self.parkingDisplayBoards.append(ParkingDisplayBoard(self))
+        self.parkingDisplayBoards = LazyList(lambda i: ParkingDisplayBoard(self), self.numParkingDisplayBoards)
         
-        self.tickets = []
+        #Any object with the TicketStore methods can be plugged in, e.g. sqlitestore.SQLiteTicketStore.
+        #Tickets it already holds occupy their spots again.
+        self.tickets = ticketStore if ticketStore is not None else TicketStore()
+        ParkingTicket.advanceNumber(self.tickets.maxTicketNumber())
+        for ticket in self.tickets.unpaid():
+            self.allocator.claim(*ticket.spotIndex)
+
+        #Durability: when an EventJournal is attached every state change is recorded under journalLock,
+        #so a snapshot taken under the same lock always matches the journal position. Without a journal
+        #the gates do not take it (see eventLock).
+        self.journal = None
+        self.journalLock = threading.Lock()
+        #Set by metrics.Metrics.instrument while the lot is instrumented.
+        self.metrics = None
+        #Set by reservations.ReservationBook when the lot takes reservations.
+        self.reservations = None
+        #Set by pricing.DynamicPricing; without it every ticket pays the plain tariff (factor 1).
+        self.pricing = None
+        #Set by payments.PaymentProcessor; without it card payments are accepted at the gate as before.
+        self.payments = None
+        #Numbers of paid tickets being refunded right now, guarded by journalLock (see refundTicket).
+        self.refunding = set()
+        #Floors rebuilt under journalLock whose reservations have not been moved yet (see floorsRebuilt).
+        self.rebuiltFloors = []
             
     def addEntrancePanel(self):
         self.numEntrancePanels += 1
-        self.entrancePanels.append(EntrancePanel(self.numEntrancePanels))
+        self.entrancePanels.grow(1)
+        if self.metrics is not None:
+            self.metrics.instrumentPanels(self)
 
     def addExitPanel(self):
         self.numExitPanels += 1
-        self.exitPanels.append(ExitPanel(self.numExitPanels))
-        
+        self.exitPanels.grow(1)
+        if self.metrics is not None:
+            self.metrics.instrumentPanels(self)
+
+    @property
+    def codec(self):
+        #Two gates racing here build equal codecs from the same key, so no lock is needed.
+        if self.ticketCodec is None:
+            self.ticketCodec = TicketCodec(self.tokenKey)
+        return self.ticketCodec
+
+    def newFloor(self, ident, layout: tuple):
+        if self.grid is not None:
+            return CompactFloor(ident, self.grid, layout)
+        return ParkingFloor(ident, layout)
+
+    def numFloors(self):
+        #Floors in the lot, counting the ones being drained but not removed ones.
+        return sum(1 for floor in self.floors if floor.sections)
+
+    def capacity(self, vehType: VehicleType):
+        #Spots for the vehicle type on floors that are open.
+        return self.allocator.capacity[vehType]
+
+    def freeSpots(self, vehType: VehicleType):
+        if vehType == VehicleType.CAR: return self.freeSpotsCars
+        elif vehType == VehicleType.TRUCK: return self.freeSpotsTrucks
+        elif vehType == VehicleType.VAN: return self.freeSpotsVans
+        else: return self.freeSpotsMotorcycles
+
+    def changeFreeSpots(self, vehType: VehicleType, delta: int):
+        if vehType == VehicleType.CAR: self.freeSpotsCars += delta
+        elif vehType == VehicleType.TRUCK: self.freeSpotsTrucks += delta
+        elif vehType == VehicleType.VAN: self.freeSpotsVans += delta
+        else: self.freeSpotsMotorcycles += delta
+
+    def checkSpotCode(self, spot: str, vehType: VehicleType):
+        code = parseSpotCode(spot)
+        if code is None:
+            return GateStatus.INVALID_SPOT
+        fl, se, sp = code
+        if fl < 0 or fl >= len(self.floors) or not self.allocator.active[fl]:
+            return GateStatus.INVALID_SPOT
+        if se < 0 or se >= len(self.floors[fl].sections):
+            return GateStatus.INVALID_SPOT
+        if sp < 0 or sp >= len(self.floors[fl].sections[se].spots):
+            return GateStatus.INVALID_SPOT
+        if self.floors[fl].sections[se].vehicleType != vehType:
+            return GateStatus.WRONG_SECTION
+        if not (self.allocator.spotMasks[fl][se] >> sp) & 1:
+            return GateStatus.SPOT_OCCUPIED
+        return GateStatus.OK
+
+    #Programmatic gate API: no prompts and no prints, for gate controllers and load tests.
+    #The console panels are adapters over these two methods.
+    def issueTicket(self, vehicleType, pet: bool, spot: str = None, preference: FloorPreference = FloorPreference.NEAREST):
+        vehType = VehicleType(vehicleType)
+        if self.reservations is not None:
+            self.reservations.advance(self.clock())
+        if spot is None:
+            parkingSpot = self.allocator.allocate(vehType, preference)
+            if parkingSpot is None:
+                return EntryResult(GateStatus.LOT_FULL)
+            spot = parkingSpot.code()
+            fl, se, sp = spotIndex(parkingSpot)
+        else:
+            status = self.checkSpotCode(spot, vehType)
+            if status != GateStatus.OK:
+                return EntryResult(status)
+            fl, se, sp = parseSpotCode(spot)
+            if not self.allocator.claim(fl, se, sp, vehType):
+                return EntryResult(GateStatus.SPOT_OCCUPIED)
+        try:
+            ticket = self.openTicket(vehType, pet, spot, (fl, se, sp))
+        except BaseException:
+            #Nothing was issued (e.g. the journal could not be written): the spot is free again.
+            self.allocator.release(self.floors[fl].sections[se].spots[sp])
+            raise
+        return EntryResult(GateStatus.OK, ticket)
+
+    def openTicket(self, vehType: VehicleType, pet: bool, spot: str, spotIndex: tuple = None):
+        #Issues the ticket for a spot the caller has already occupied.
+        ticket = ParkingTicket(self, vehType.value, pet, spot, spotIndex)
+        if self.pricing is not None:
+            ticket.priceFactor = self.pricing.factor(vehType, ticket.issuedAtDate)
+        ticket.token = self.codec.encode(ticket)
+        with self.eventLock():
+            self.record("I", ticket.ticketNumber, vehType.value, pet, spot, ticket.issuedAtDate.timestamp(), ticket.priceFactor)
+            try:
+                self.tickets.add(ticket)
+            except BaseException:
+                #Already journaled: void it there too, so a restore does not bring back a ticket nobody got.
+                self.record("C", ticket.ticketNumber, ticket.issuedAtDate.timestamp())
+                raise
+        return ticket
+
+    def checkout(self, ticketNumber: int, paymentMethod: PaymentMethod = PaymentMethod.CARD):
+        #The ticket is claimed before the card is charged, so when several gates race to pay it only one
+        #of them gets as far as the card.
+        ticket = self.tickets.claim(ticketNumber)
+        if ticket is None:
+            return CheckoutResult(GateStatus.NO_UNPAID_TICKET)
+        return self.checkoutTicket(ticket, paymentMethod)
+
+    async def checkoutAsync(self, ticketNumber: int, paymentMethod, authorize):
+        #checkout for asyncio gates (gateserver): authorize is a coroutine function (ticket, payment) -> bool
+        #that is awaited instead of blocking on the payment processor. Every other step is shared with checkout.
+        ticket = self.tickets.claim(ticketNumber)
+        if ticket is None:
+            return CheckoutResult(GateStatus.NO_UNPAID_TICKET)
+        try:
+            payment = self.priceCheckout(ticket, paymentMethod)
+            approved = await authorize(ticket, payment)
+        except BaseException:
+            self.tickets.unclaim(ticket)
+            raise
+        return self.finishCheckout(ticket, payment, approved)
+
+    def checkoutToken(self, token: str, paymentMethod: PaymentMethod = PaymentMethod.CARD, decoded: tuple = None):
+        #Exit path for a scanned ticket code: a forged or mistyped code is rejected by its signature before
+        #anything is looked up, and the only lookup is the in-memory open-ticket map, never the backing
+        #store, so exits keep working while the store is slow or unreachable (the SQLite store keeps
+        #unwritten changes queued until it can write them again).
+        if decoded is None:
+            decoded = self.codec.decode(token)
+        if decoded is None:
+            return CheckoutResult(GateStatus.INVALID_TOKEN)
+        ticket = self.tickets.claim(decoded[0])
+        if ticket is None:
+            return CheckoutResult(GateStatus.NO_UNPAID_TICKET)
+        #Priced from the open ticket: the attendant may have changed the fee since the code was printed,
+        #and the code keeps the issue time only to the second.
+        return self.checkoutTicket(ticket, paymentMethod)
+
+    def checkoutTicket(self, ticket, paymentMethod):
+        #The steps of a checkout once the gate has claimed the ticket: price, authorize, settle.
+        try:
+            payment = self.priceCheckout(ticket, paymentMethod)
+            approved = self.authorize(ticket, payment)
+        except BaseException:
+            self.tickets.unclaim(ticket)
+            raise
+        return self.finishCheckout(ticket, payment, approved)
+
+    def priceCheckout(self, ticket, paymentMethod):
+        payment = Payment(ticket.issuedAtDate, ticket.additionalFee, self.tariff, self.clock, ticket.priceFactor)
+        payment.method = PaymentMethod(paymentMethod)
+        return payment
+
+    def finishCheckout(self, ticket, payment, approved: bool):
+        #A declined ticket is handed back so the driver can pay another way. A charge is never kept for a
+        #ticket that could not be settled (e.g. an attendant voided it meanwhile): it is refunded.
+        if not approved:
+            self.tickets.unclaim(ticket)
+            return CheckoutResult(GateStatus.PAYMENT_DECLINED, ticket, payment.amount)
+        try:
+            settled = self.settleTicket(ticket, payment)
+        except BaseException:
+            self.tickets.unclaim(ticket)
+            self.voidPayment(ticket, payment)
+            raise
+        if not settled:
+            self.tickets.unclaim(ticket)
+            self.voidPayment(ticket, payment)
+            return CheckoutResult(GateStatus.NO_UNPAID_TICKET)
+        return CheckoutResult(GateStatus.OK, ticket, payment.amount)
+
+    def checkoutTokens(self, tokens: list, paymentMethod: PaymentMethod = PaymentMethod.CARD):
+        #Verifies a batch of codes in one pass (one key setup for all of them), then checks each one out.
+        return [self.checkoutToken(token, paymentMethod, decoded) if decoded is not None else CheckoutResult(GateStatus.INVALID_TOKEN) for token, decoded in zip(tokens, self.codec.decodeMany(tokens))]
+
+    def quote(self, token: str):
+        #The fee for a ticket code right now, from the code alone (no lookup at all), e.g. for a pay
+        #station or while the lot cannot reach its tickets. None if the code is not valid.
+        decoded = self.codec.decode(token)
+        if decoded is None:
+            return None
+        return self.tariff.price((self.clock() - datetime.datetime.fromtimestamp(decoded[4])).total_seconds(), decoded[7]) * decoded[8]
+
+    def authorize(self, ticket, payment):
+        #Charges a card through the payment processor, blocking only the calling gate. Cash, free stays
+        #and lots without a processor need no authorization.
+        if self.payments is None or payment.method != PaymentMethod.CARD or payment.amount <= 0:
+            return True
+        return self.payments.authorize(ticket.ticketNumber, payment.amount).result()
+
+    def voidPayment(self, ticket, payment):
+        #Gives back an authorized card payment that did not pay for the ticket. Does not wait for the gateway.
+        if self.payments is not None and payment.method == PaymentMethod.CARD and payment.amount > 0:
+            self.payments.refund(ticket.ticketNumber, payment.amount)
+
+    def settleTicket(self, ticket, payment):
+        #Marks a ticket as paid and frees its spot. Returns False if the ticket was already paid at another gate.
+        return self.markPaid(ticket, payment.amount, self.clock(), method=payment.method)
+
+    def cancelTicket(self, ticket):
+        #Voids an unpaid ticket: nothing is charged and the spot is freed. Not while a gate is charging it.
+        if self.tickets.claim(ticket.ticketNumber) is None:
+            return False
+        if not self.markPaid(ticket, 0, self.clock(), PaymentStatus.CANCELLED):
+            self.tickets.unclaim(ticket)
+            return False
+        return True
+
+    def refundTicket(self, ticket):
+        #Gives back the payment of a completed ticket. Card payments go back through the processor if the lot
+        #has one; cash (and tickets paid before the method was stored) is handed back at the desk. The ticket
+        #is claimed in `refunding` before the gateway is called, so concurrent refunds reach it only once.
+        number = ticket.ticketNumber
+        with self.journalLock:
+            ticket = self.tickets.get(number)
+            if ticket is None or ticket.payStatus != PaymentStatus.COMPLETED.name or number in self.refunding:
+                return False
+            self.refunding.add(number)
+        try:
+            refunded = self.payments is None or ticket.payMethod != PaymentMethod.CARD or ticket.payAmount <= 0 or self.payments.refund(number, ticket.payAmount).result()
+        except BaseException:
+            with self.journalLock:
+                self.refunding.discard(number)
+            raise
+        with self.journalLock:
+            self.refunding.discard(number)
+            if not refunded:
+                return False
+            self.record("R", number)
+            ticket.payStatus = PaymentStatus.REFUNDED.name
+            self.tickets.update(ticket)
+        return True
+
+    def projectedRevenue(self, at=None):
+        #What all open tickets would pay if they left at `at` (default: now).
+        if at is None:
+            at = self.clock()
+        return self.tariff.projectedRevenue(self.tickets.unpaid(), at)
+
+    def markPaid(self, ticket, amount: float, paidAtDate, status: PaymentStatus = PaymentStatus.COMPLETED, method: PaymentMethod = None):
+        #The event is journaled before the ticket is archived, so a failed journal write leaves the ticket
+        #open and its spot taken, as if nothing happened. With a journal, journalLock makes the open check
+        #and the archive one step; without one archive() alone decides which gate wins.
+        with self.eventLock():
+            if self.tickets.getOpen(ticket.ticketNumber) is None:
+                return False
+            if status == PaymentStatus.COMPLETED:
+                self.record("P", ticket.ticketNumber, amount, paidAtDate.timestamp(), method.value if method is not None else None)
+            else:
+                self.record("C", ticket.ticketNumber, paidAtDate.timestamp())
+            if not self.tickets.archive(ticket, paidAtDate):
+                return False
+            ticket.payAmount = amount
+            ticket.payStatus = status.name
+            ticket.payMethod = method
+            ticket.paidAtDate = paidAtDate
+            self.tickets.update(ticket)
+        fl, se, sp = ticket.spotIndex
+        self.allocator.release(self.floors[fl].sections[se].spots[sp])
+        if self.reservations is not None:
+            self.reservations.ticketPaid(ticket)
+        return True
+
+    def addParkingFloor(self, layout=None):
+        #Adds a floor with the given layout (default: the lot's floor layout) in the slot of the lowest
+        #removed floor, or on top. Returns False if the lot already has maxFloors floors.
+        with self.journalLock:
+            fl = next((fl for fl, floor in enumerate(self.floors) if not floor.sections and fl not in self.pendingLayouts), len(self.floors))
+            added = self.changeFloor(fl, normalizeLayout(layout) if layout is not None else self.floorLayout) == 0
+        self.floorsRebuilt()
+        return added
+
+    def removeParkingFloor(self, floorId: int):
+        #Drains the floor and removes it once the last parked vehicle has left. Returns how many are still
+        #parked, or None if there is no such floor.
+        if floorId < 1 or floorId > len(self.floors) or not self.floors[floorId - 1].sections:
+            return None
+        return self.setFloorLayout(floorId, ())
+
+    def setFloorLayout(self, floorId: int, layout):
+        #Changes the lot while it is open: adds floor len(floors) + 1, builds a removed floor again, grows
+        #a floor, or drains it for a new layout or for removal (layout ()). Growing (more spots at the end
+        #of sections, new sections after the last one) happens at once. Any other change drains the floor
+        #first: gates stop sending vehicles there and the new layout is built when the last one leaves.
+        #Only the floor being changed is locked. Returns the number of vehicles still to leave before the
+        #layout is in place (0 if it already is), or None if the floor cannot be changed (no such floor,
+        #maxFloors reached, or a layout the ticket codes cannot hold).
+        with self.journalLock:
+            remaining = self.changeFloor(floorId - 1, normalizeLayout(layout))
+        self.floorsRebuilt()
+        return remaining
+
+    def changeFloor(self, fl: int, layout: tuple):
+        #Caller holds journalLock.
+        floorId = fl + 1
+        if fl < 0 or fl > len(self.floors):
+            return None
+        if len(layout) > TicketCodec.MAX_SECTIONS or any(numSpots < 1 or numSpots > TicketCodec.MAX_SPOTS for vt, numSpots in layout):
+            return None
+        current = self.floors[fl].layout() if fl < len(self.floors) else ()
+        if fl in self.pendingLayouts:
+            if layout == current:
+                #Changed back before the floor was empty: reopen it as it is.
+                del self.pendingLayouts[fl]
+                self.allocator.addFloor(self.floors[fl])
+                self.record("L", floorId, layoutState(layout))
+                return 0
+            self.pendingLayouts[fl] = layout
+            self.record("D", floorId, layoutState(layout))
+            remaining = self.allocator.occupied(fl)
+            if remaining == 0:
+                self.rebuildDrained(fl)
+            return remaining
+        if layout == current:
+            return 0
+        if not current:
+            if self.numFloors() >= self.maxFloors:
+                return None
+            self.placeFloor(fl, layout)
+            self.record("L", floorId, layoutState(layout))
+            return 0
+        if layout and growsLayout(current, layout):
+            self.allocator.growFloor(self.floors[fl], layout)
+            self.record("L", floorId, layoutState(layout))
+            return 0
+        self.pendingLayouts[fl] = layout
+        self.record("D", floorId, layoutState(layout))
+        remaining = self.allocator.drainFloor(fl)
+        if remaining == 0:
+            self.rebuildDrained(fl)
+        return remaining
+
+    def placeFloor(self, fl: int, layout: tuple):
+        #Caller holds journalLock. Builds floor fl with the layout, on top of the lot or in place of a
+        #drained, empty floor.
+        floor = self.newFloor(fl + 1, layout)
+        if fl == len(self.floors):
+            self.floors.append(floor)
+            self.allocator.addFloor(floor)
+            for i in range(self.panelsPerFloor):
+                self.addEntrancePanel()
+                self.addExitPanel()
+            self.numParkingDisplayBoards += 1
+            self.parkingDisplayBoards.grow(1)
+            return
+        self.allocator.drainFloor(fl)
+        self.allocator.removeFloor(fl)
+        self.floors[fl] = floor
+        self.allocator.addFloor(floor)
+
+    def finishDrain(self, fl: int):
+        #Called when a vehicle leaves a draining floor: puts the pending layout in place once it is empty.
+        with self.journalLock:
+            if fl in self.pendingLayouts and self.allocator.occupied(fl) == 0:
+                self.rebuildDrained(fl)
+        self.floorsRebuilt()
+
+    def rebuildDrained(self, fl: int):
+        #Caller holds journalLock, and calls floorsRebuilt once it has let go of it.
+        layout = self.pendingLayouts.pop(fl)
+        self.placeFloor(fl, layout)
+        self.record("L", fl + 1, layoutState(layout))
+        self.rebuiltFloors.append(fl)
+
+    def floorsRebuilt(self):
+        #Moves the reservations off floors that were rebuilt. Not under journalLock: the reservation book
+        #takes its own lock first and journalLock inside it.
+        if not self.rebuiltFloors:
+            return
+        with self.journalLock:
+            floors, self.rebuiltFloors = self.rebuiltFloors, []
+        if self.reservations is not None:
+            for fl in floors:
+                self.reservations.floorRebuilt(fl)
+
+    def eventLock(self):
+        #journalLock while a journal is attached. Without one, issuing and paying need no lot-wide lock:
+        #the ticket store and the allocator lock what they change. A journal is attached by
+        #EventJournal.restore before the gates open.
+        return self.journalLock if self.journal is not None else NO_LOCK
+
+    def record(self, *event):
+        #Caller holds journalLock.
+        if self.journal is not None:
+            self.journal.append(event)
+
+    def recordAttendant(self):
+        self.record("A", self.parkingAttendant.username, self.parkingAttendant.password, self.parkingAttendant.status)
+
+    def snapshotState(self):
+        #Caller holds journalLock. Spot occupancy is not stored: it follows from the open tickets.
+        tickets = []
+        for t in self.tickets:
+            paidAt = t.paidAtDate.timestamp() if t.paidAtDate != "" else None
+            tickets.append([t.ticketNumber, t.vehicleType.value, t.pet, t.spot, t.issuedAtDate.timestamp(), t.additionalFee, paidAt, t.payAmount, t.priceFactor, t.payStatus, t.payMethod.value if t.payMethod is not None else None])
+        attendant = [self.parkingAttendant.username, self.parkingAttendant.password, self.parkingAttendant.status]
+        floors = [[layoutState(floor.layout()), layoutState(self.pendingLayouts[fl]) if fl in self.pendingLayouts else None] for fl, floor in enumerate(self.floors)]
+        return {"numFloors": len(self.floors), "floors": floors, "ticketNumber": ParkingTicket.ticketNumber, "attendant": attendant, "tickets": tickets}
+
+    def loadState(self, state: dict):
+        #Rebuilds the lot from a snapshot-shaped state in bulk: the store indexes are built with one sort each.
+        #state["floors"] holds [layout, pending layout] per floor; a missing entry (state written before
+        #floor layouts were recorded) means the lot's floor layout. Floors are rebuilt before the tickets
+        #occupy their spots, and draining resumes after.
+        floors = state.get("floors", [])
+        with self.journalLock:
+            for fl in range(max(state["numFloors"], len(floors))):
+                entry = floors[fl] if fl < len(floors) else None
+                layout = self.floorLayout if entry is None or entry[0] is None else normalizeLayout(entry[0])
+                if fl == len(self.floors) or self.floors[fl].layout() != layout:
+                    self.placeFloor(fl, layout)
+        self.parkingAttendant.username, self.parkingAttendant.password, self.parkingAttendant.status = state["attendant"]
+        tickets = [ParkingTicket.restore(*t) for t in state["tickets"]]
+        with self.journalLock:
+            self.tickets.load(tickets)
+        for ticket in self.tickets.openTickets.values():
+            self.allocator.claim(*ticket.spotIndex)
+        ParkingTicket.advanceNumber(state["ticketNumber"])
+        with self.journalLock:
+            for fl, entry in enumerate(floors):
+                if entry is not None and entry[1] is not None and self.floors[fl].sections:
+                    self.pendingLayouts[fl] = normalizeLayout(entry[1])
+                    self.allocator.drainFloor(fl)
+        for fl in list(self.pendingLayouts):
+            self.finishDrain(fl)
+
+class EntryResult():
+    def __init__(self, status: GateStatus, ticket=None):
+        self.status = status
+        self.ticket = ticket
+        self.ok = status == GateStatus.OK
+
+class CheckoutResult():
+    def __init__(self, status: GateStatus, ticket=None, amount: float = 0):
+        self.status = status
+        self.ticket = ticket
+        self.amount = amount
+        self.ok = status == GateStatus.OK
+
+class SpotAllocator():
+    #Keeps a bitmap of free spots for every section, a bitmap of sections with free spots per floor and
+    #vehicle type, and a bitmap of floors with free spots per vehicle type. Picking the lowest/highest set
+    #bit gives the next free spot without walking the floors, and the freeSpots* counters are updated here.
+    #Locking: a floor's spot and section bitmaps (and its isFree flags) change only under that floor's lock,
+    #so gates working on different floors never wait for each other. The per-type floor bitmap and the
+    #freeSpots* counter are shared by every floor and have their own short per-type lock, always taken
+    #after the floor lock.
+    def __init__(self, parkingLot: ParkingLot):
+        self.pl = parkingLot
+        self.spotMasks = []
+        self.sectionMasks = {vt: [] for vt in VehicleType}
+        self.floorMasks = {vt: 0 for vt in VehicleType}
+        self.floorLocks = []
+        #Occupancy aggregates, kept up to date on every change. floorVersions is bumped whenever a spot
+        #on the floor changes, which is what the display boards use to invalidate their cache.
+        self.sectionFree = []
+        self.floorFree = []
+        self.floorVersions = []
+        self.typeLocks = {vt: threading.Lock() for vt in VehicleType}
+        self.topologyLock = threading.Lock()
+        #Floors being drained or removed are not active: nothing is allocated there.
+        self.active = []
+        #Spots per vehicle type on active floors.
+        self.capacity = {vt: 0 for vt in VehicleType}
+
+    def addFloor(self, floor):
+        self.addFloors([floor])
+
+    def addFloors(self, floors: list):
+        #Indexes floors that were appended to pl.floors or put in the slot of a removed one (floor.id - 1).
+        #Other floors are not touched, so the gates keep running; the per-type bitmaps, which is where
+        #allocate() looks, are updated last, once for all the floors (the lot's constructor passes them all).
+        added = {vt: [0, 0, 0] for vt in VehicleType}
+        with self.topologyLock:
+            for floor in floors:
+                fl = floor.id - 1
+                if fl == len(self.spotMasks):
+                    self.floorLocks.append(threading.Lock())
+                    for vt in VehicleType:
+                        self.sectionMasks[vt].append(0)
+                    self.sectionFree.append([])
+                    self.floorFree.append(0)
+                    self.floorVersions.append(0)
+                    self.spotMasks.append([])
+                    self.active.append(False)
+                with self.floorLocks[fl]:
+                    masks = [section.freeMask() for section in floor.sections]
+                    self.sectionFree[fl] = [mask.bit_count() for mask in masks]
+                    self.floorFree[fl] = sum(self.sectionFree[fl])
+                    self.floorVersions[fl] += 1
+                    self.spotMasks[fl] = masks
+                    self.active[fl] = len(masks) > 0
+                    for se, section in enumerate(floor.sections):
+                        #[spots, free spots, floors with free spots] per vehicle type.
+                        totals = added[section.vehicleType]
+                        totals[0] += len(section.spots)
+                        totals[1] += self.sectionFree[fl][se]
+                        if masks[se]:
+                            self.sectionMasks[section.vehicleType][fl] |= 1 << se
+                            totals[2] |= 1 << fl
+            for vt, (numSpots, free, floorBits) in added.items():
+                self.pl.totalSpots += numSpots
+                with self.typeLocks[vt]:
+                    self.capacity[vt] += numSpots
+                    self.floorMasks[vt] |= floorBits
+                    self.pl.changeFreeSpots(vt, free)
+
+    def addSpots(self, fl: int, se: int, vehType: VehicleType, numSpots: int, free: int):
+        #Caller holds the floor lock. Counts numSpots new spots of the section, free of them available.
+        self.pl.totalSpots += numSpots
+        with self.typeLocks[vehType]:
+            self.capacity[vehType] += numSpots
+            if self.spotMasks[fl][se]:
+                self.sectionMasks[vehType][fl] |= 1 << se
+                self.floorMasks[vehType] |= 1 << fl
+            self.pl.changeFreeSpots(vehType, free)
+
+    def growFloor(self, floor, layout: tuple):
+        #Adds spots at the end of existing sections and new sections after the last one. Spot indexes do
+        #not change, so open tickets and the bitmaps of other sections stay valid.
+        fl = floor.id - 1
+        with self.topologyLock, self.floorLocks[fl]:
+            for se, (vehType, numSpots) in enumerate(layout):
+                if se < len(floor.sections):
+                    old = len(floor.sections[se].spots)
+                    if numSpots == old:
+                        continue
+                    floor.sections[se].grow(numSpots - old)
+                else:
+                    old = 0
+                    self.spotMasks[fl].append(0)
+                    self.sectionFree[fl].append(0)
+                    floor.addSection(vehType, numSpots)
+                self.spotMasks[fl][se] |= ((1 << numSpots) - 1) ^ ((1 << old) - 1)
+                self.sectionFree[fl][se] += numSpots - old
+                self.floorFree[fl] += numSpots - old
+                self.addSpots(fl, se, vehType, numSpots - old, numSpots - old)
+            self.floorVersions[fl] += 1
+
+    def drainFloor(self, fl: int):
+        #Stops allocating on the floor: its spots no longer count as free or as capacity, and claim()
+        #refuses them. Parked vehicles leave as usual. Returns how many are still parked.
+        floor = self.pl.floors[fl]
+        with self.topologyLock, self.floorLocks[fl]:
+            if self.active[fl]:
+                self.active[fl] = False
+                self.floorVersions[fl] += 1
+                for se, section in enumerate(floor.sections):
+                    self.pl.totalSpots -= len(section.spots)
+                    with self.typeLocks[section.vehicleType]:
+                        self.capacity[section.vehicleType] -= len(section.spots)
+                        self.sectionMasks[section.vehicleType][fl] = 0
+                        self.floorMasks[section.vehicleType] &= ~(1 << fl)
+                        self.pl.changeFreeSpots(section.vehicleType, -self.sectionFree[fl][se])
+            return self.occupied(fl)
+
+    def removeFloor(self, fl: int):
+        #Drops the indexes of a drained, empty floor. Its slot stays, so later floors keep their indexes.
+        with self.topologyLock, self.floorLocks[fl]:
+            self.spotMasks[fl] = []
+            self.sectionFree[fl] = []
+            self.floorFree[fl] = 0
+            self.floorVersions[fl] += 1
+
+    def occupied(self, fl: int):
+        return sum(len(section.spots) for section in self.pl.floors[fl].sections) - self.floorFree[fl]
+
+    def peek(self, vehType: VehicleType, preference: FloorPreference = FloorPreference.NEAREST):
+        #Returns the (floor, section, spot) indexes of the next free spot for the vehicle type, or None if the lot is full.
+        #Without a lock the answer is only a hint: another gate may take the spot first.
+        floors = self.floorMasks[vehType]
+        if floors == 0:
+            return None
+        if preference == FloorPreference.NEAREST:
+            fl = lowestBit(floors)
+        else:
+            fl = highestBit(floors)
+        sections = self.sectionMasks[vehType][fl]
+        if sections == 0:
+            return None
+        se = lowestBit(sections)
+        sp = lowestBit(self.spotMasks[fl][se])
+        return fl, se, sp
+
+    def allocate(self, vehType: VehicleType, preference: FloorPreference = FloorPreference.NEAREST):
+        #Occupies and returns the next free spot for the vehicle type, or None if the lot is full.
+        while True:
+            floors = self.floorMasks[vehType]
+            if floors == 0:
+                return None
+            if preference == FloorPreference.NEAREST:
+                fl = lowestBit(floors)
+            else:
+                fl = highestBit(floors)
+            with self.floorLocks[fl]:
+                sections = self.sectionMasks[vehType][fl]
+                if sections == 0:
+                    continue #Another gate took the last spot on this floor; look again.
+                se = lowestBit(sections)
+                sp = lowestBit(self.spotMasks[fl][se])
+                self.occupy(fl, se, sp)
+            return self.pl.floors[fl].sections[se].spots[sp]
+
+    def claim(self, fl: int, se: int, sp: int, vehType: VehicleType = None):
+        #Occupies a spot chosen by the driver. Returns False if it is already taken, or if its floor is
+        #draining or was rebuilt since the code was checked and the spot no longer fits.
+        with self.floorLocks[fl]:
+            if not self.active[fl] or se >= len(self.spotMasks[fl]) or not (self.spotMasks[fl][se] >> sp) & 1:
+                return False
+            if vehType is not None and self.pl.floors[fl].sections[se].vehicleType != vehType:
+                return False
+            self.occupy(fl, se, sp)
+        return True
+
+    def release(self, spot):
+        fl, se, sp = spotIndex(spot)
+        vehType = self.pl.floors[fl].sections[se].vehicleType
+        with self.floorLocks[fl]:
+            if (self.spotMasks[fl][se] >> sp) & 1:
+                return
+            floorWasFull = self.sectionMasks[vehType][fl] == 0
+            if self.spotMasks[fl][se] == 0 and self.active[fl]:
+                self.sectionMasks[vehType][fl] |= 1 << se
+            self.spotMasks[fl][se] |= 1 << sp
+            self.sectionFree[fl][se] += 1
+            self.floorFree[fl] += 1
+            self.floorVersions[fl] += 1
+            spot.isFree = True
+            if self.active[fl]:
+                with self.typeLocks[vehType]:
+                    if floorWasFull:
+                        self.floorMasks[vehType] |= 1 << fl
+                    self.pl.changeFreeSpots(vehType, 1)
+        #Whoever gives the last spot of a draining floor back (a paid ticket, a cancelled or unused
+        #reservation) puts the floor's pending layout in place. The caller must not hold journalLock.
+        if fl in self.pl.pendingLayouts:
+            self.pl.finishDrain(fl)
+
+    def occupy(self, fl: int, se: int, sp: int):
+        #Caller holds the floor lock.
+        section = self.pl.floors[fl].sections[se]
+        self.spotMasks[fl][se] &= ~(1 << sp)
+        if self.spotMasks[fl][se] == 0:
+            self.sectionMasks[section.vehicleType][fl] &= ~(1 << se)
+        self.sectionFree[fl][se] -= 1
+        self.floorFree[fl] -= 1
+        self.floorVersions[fl] += 1
+        section.spots[sp].isFree = False
+        with self.typeLocks[section.vehicleType]:
+            if self.sectionMasks[section.vehicleType][fl] == 0:
+                self.floorMasks[section.vehicleType] &= ~(1 << fl)
+            self.pl.changeFreeSpots(section.vehicleType, -1)
+
+
+class TicketStore():
+    #Keeps every ticket reachable by number in O(1). Unpaid tickets live in the open (hot) set and
+    #move to the archive once they are paid. The issued/paid indexes are kept sorted by date.
+    #Lookups read the dicts without locking; every change goes through self.lock.
+    #This is also the storage interface: other backends (sqlitestore.SQLiteTicketStore) provide the same methods.
+    def __init__(self):
+        self.openTickets = {}
+        self.archivedTickets = {}
+        self.issuedIndex = []
+        self.paidIndex = []
+        #Numbers of open tickets a gate is charging right now (see claim).
+        self.claimed = set()
+        self.lock = threading.Lock()
+
+    def add(self, ticket):
+        with self.lock:
+            self.openTickets[ticket.ticketNumber] = ticket
+            bisect.insort(self.issuedIndex, (ticket.issuedAtDate, ticket.ticketNumber))
+
+    def get(self, ticketNumber: int):
+        ticket = self.openTickets.get(ticketNumber)
+        if ticket is None:
+            ticket = self.archivedTickets.get(ticketNumber)
+        return ticket
+
+    def getOpen(self, ticketNumber: int):
+        return self.openTickets.get(ticketNumber)
+
+    def claim(self, ticketNumber: int):
+        #Reserves an open ticket for the gate that is about to charge it, before any card is authorized.
+        #Returns the ticket, or None if it is not open or another gate holds it. The claim ends when the
+        #ticket is archived or handed back with unclaim().
+        with self.lock:
+            ticket = self.openTickets.get(ticketNumber)
+            if ticket is None or ticketNumber in self.claimed:
+                return None
+            self.claimed.add(ticketNumber)
+            return ticket
+
+    def unclaim(self, ticket):
+        with self.lock:
+            self.claimed.discard(ticket.ticketNumber)
+
+    def archive(self, ticket, paidAtDate):
+        #Called once the ticket has been paid: takes it out of the hot set. Returns False if another
+        #gate archived it first, so a ticket can only be paid once.
+        with self.lock:
+            if ticket.ticketNumber not in self.openTickets:
+                return False
+            self.claimed.discard(ticket.ticketNumber)
+            self.archivedTickets[ticket.ticketNumber] = ticket
+            del self.openTickets[ticket.ticketNumber]
+            bisect.insort(self.paidIndex, (paidAtDate, ticket.ticketNumber))
+        return True
+
+    def load(self, tickets):
+        #Adds many restored tickets at once, paid ones straight into the archive.
+        unpaid = PaymentStatus(1).name
+        with self.lock:
+            for ticket in tickets:
+                if ticket.payStatus == unpaid:
+                    self.openTickets[ticket.ticketNumber] = ticket
+                else:
+                    self.archivedTickets[ticket.ticketNumber] = ticket
+                    self.paidIndex.append((ticket.paidAtDate, ticket.ticketNumber))
+                self.issuedIndex.append((ticket.issuedAtDate, ticket.ticketNumber))
+            self.issuedIndex.sort()
+            self.paidIndex.sort()
+
+    def update(self, ticket):
+        #Tickets are shared objects here, so there is nothing to write back.
+        pass
+
+    def unpaid(self):
+        return list(self.openTickets.values())
+
+    def maxTicketNumber(self):
+        return max(self.openTickets.keys() | self.archivedTickets.keys(), default=0)
+
+    def page(self, offset: int, limit: int):
+        #Tickets in issue order, limit at a time.
+        with self.lock:
+            found = self.issuedIndex[offset:offset + limit]
+        return [self.get(num) for date, num in found]
+
+    def issuedBetween(self, start, end):
+        return self.rangeQuery(self.issuedIndex, start, end)
+
+    def paidBetween(self, start, end):
+        return self.rangeQuery(self.paidIndex, start, end)
+
+    def rangeQuery(self, index, start, end):
+        #Tickets whose date is in [start, end).
+        with self.lock:
+            lo = bisect.bisect_left(index, (start,))
+            hi = bisect.bisect_left(index, (end,))
+            found = index[lo:hi]
+        return [self.get(num) for date, num in found]
+
+    def scan(self, start=None, end=None, chunkSize: int = 1000):
+        #Yields lists of up to chunkSize tickets issued in [start, end) (open-ended when None), in issue
+        #order. Each chunk continues after the last key of the previous one, so only one chunk is copied
+        #at a time and tickets issued meanwhile do not shift it.
+        with self.lock:
+            position = 0 if start is None else bisect.bisect_left(self.issuedIndex, (start,))
+        while True:
+            with self.lock:
+                found = self.issuedIndex[position:position + chunkSize]
+            if end is not None:
+                found = [key for key in found if key[0] < end]
+            if not found:
+                return
+            yield [self.get(num) for date, num in found]
+            if len(found) < chunkSize:
+                return
+            with self.lock:
+                position = bisect.bisect_right(self.issuedIndex, found[-1])
+
+    def numOpen(self):
+        return len(self.openTickets)
+
+    def __len__(self):
+        return len(self.openTickets) + len(self.archivedTickets)
+
+    def __iter__(self):
+        #All tickets in the order they were issued.
+        for chunk in self.scan():
+            yield from chunk
+
+    def __getitem__(self, position: int):
+        return self.get(self.issuedIndex[position][1])
 
 class ParkingTicket():
     ticketNumber = 0
-    def __init__(self, parkingLot: ParkingLot, vehType: int, pet: bool, spot: str):
-        ParkingTicket.ticketNumber += 1
-        self.ticketNumber = ParkingTicket.ticketNumber
+    numberLock = threading.Lock()
+    def __init__(self, parkingLot: ParkingLot, vehType: int, pet: bool, spot: str, spotIndex: tuple = None):
+        with ParkingTicket.numberLock:
+            ParkingTicket.ticketNumber += 1
+            self.ticketNumber = ParkingTicket.ticketNumber
         self.vehicleType = VehicleType(vehType)
         self.spot = spot
+        #(floor, section, spot) indexes, parsed once here instead of every time the spot is used.
+        self.spotIndex = spotIndex if spotIndex is not None else parseSpotCode(spot)
+        self.token = ""
+        #Multiplies the tariff for this ticket; fixed when the ticket is issued.
+        self.priceFactor = 1.0
         self.pet = pet
-        self.issuedAtDate = datetime.datetime.now()
+        self.issuedAtDate = parkingLot.clock()
         self.paidAtDate = ""
         self.payAmount = 0
         self.payStatus = PaymentStatus(1).name
+        #The PaymentMethod the ticket was paid with; None while unpaid.
+        self.payMethod = None
         self.additionalFee = False
-        if(vehType == 1):
-            parkingLot.freeSpotsCars -= 1
-        if(vehType == 2):
-            parkingLot.freeSpotsTrucks -= 1
-        if(vehType == 3):
-            parkingLot.freeSpotsVans -= 1
-        if(vehType == 4):
-            parkingLot.freeSpotsMotorcycles -= 1
+
+    @classmethod
+    def restore(cls, number: int, vehType: int, pet: bool, spot: str, issuedAt: float, additionalFee: bool, paidAt: float = None, payAmount: float = 0, priceFactor: float = 1.0, payStatus: str = None, payMethod: int = None):
+        #Rebuilds a ticket read back from storage (times as timestamps) without drawing a new number.
+        ticket = cls.__new__(cls)
+        ticket.ticketNumber = number
+        ticket.vehicleType = VehicleType(vehType)
+        ticket.spot = spot
+        ticket.spotIndex = parseSpotCode(spot)
+        ticket.token = ""
+        ticket.priceFactor = priceFactor
+        ticket.pet = bool(pet)
+        ticket.issuedAtDate = datetime.datetime.fromtimestamp(issuedAt)
+        ticket.additionalFee = bool(additionalFee)
+        if paidAt is None:
+            ticket.paidAtDate = ""
+            ticket.payAmount = 0
+            ticket.payStatus = PaymentStatus(1).name
+        else:
+            ticket.paidAtDate = datetime.datetime.fromtimestamp(paidAt)
+            ticket.payAmount = payAmount
+            ticket.payStatus = PaymentStatus(2).name
+        if payStatus is not None:
+            ticket.payStatus = payStatus
+        ticket.payMethod = PaymentMethod(payMethod) if payMethod is not None else None
+        return ticket
+
+    @classmethod
+    def advanceNumber(cls, number: int):
+        with cls.numberLock:
+            if number > cls.ticketNumber:
+                cls.ticketNumber = number
+
+class TicketCodec():
+    #The code printed on a ticket: ticket number, spot indexes, issue time (whole seconds), vehicle type,
+    #pet, additional fee and price factor (in thousandths) packed into 16 bytes, followed by a truncated
+    #HMAC-SHA256 of them, in base32 without padding (case-insensitive, so it also works typed in or as a QR code).
+    MAC_SIZE = 10
+    #Largest floor layout a code can hold.
+    MAX_SECTIONS = 256
+    MAX_SPOTS = 65536
+
+    def __init__(self, key: bytes):
+        #Imported here, not at the top of the module: a lot builds its codec the first time it needs one.
+        import base64, hashlib, hmac, struct
+        self.layout = struct.Struct(">IHBHIBH")
+        self.b32encode = base64.b32encode
+        self.b32decode = base64.b32decode
+        self.compareDigest = hmac.compare_digest
+        #The keyed HMAC state is built once and copied for every code.
+        self.mac = hmac.new(key, digestmod=hashlib.sha256)
+
+    def sign(self, body: bytes):
+        mac = self.mac.copy()
+        mac.update(body)
+        return mac.digest()[:self.MAC_SIZE]
+
+    def encode(self, ticket: ParkingTicket):
+        fl, se, sp = ticket.spotIndex
+        flags = ticket.vehicleType.value | ticket.pet << 3 | ticket.additionalFee << 4
+        body = self.layout.pack(ticket.ticketNumber, fl, se, sp, int(ticket.issuedAtDate.timestamp()), flags, round(ticket.priceFactor * 1000))
+        return self.b32encode(body + self.sign(body)).decode().rstrip("=")
+
+    def decode(self, token: str):
+        #Returns (number, floor, section, spot, issuedAt, vehicleType, pet, additionalFee, priceFactor), or None if the
+        #code is malformed or its signature does not match.
+        return self.decodeMany([token])[0]
+
+    def decodeMany(self, tokens: list):
+        #Verifies many codes in one loop with everything it needs bound locally.
+        b32decode = self.b32decode
+        copy = self.mac.copy
+        compareDigest = self.compareDigest
+        unpack = self.layout.unpack
+        size = self.layout.size
+        macSize = self.MAC_SIZE
+        decoded = []
+        for token in tokens:
+            token = token.strip().upper()
+            try:
+                raw = b32decode(token + "=" * (-len(token) % 8))
+            except ValueError:
+                decoded.append(None)
+                continue
+            if len(raw) != size + macSize:
+                decoded.append(None)
+                continue
+            mac = copy()
+            mac.update(raw[:size])
+            if not compareDigest(raw[size:], mac.digest()[:macSize]):
+                decoded.append(None)
+                continue
+            number, fl, se, sp, issuedAt, flags, factor = unpack(raw[:size])
+            decoded.append((number, fl, se, sp, issuedAt, flags & 7, bool(flags & 8), bool(flags & 16), factor / 1000))
+        return decoded
 
 class EntrancePanel():
     def __init__(self, ident, parkingLot: ParkingLot):
@@ -84,6 +1095,13 @@ class EntrancePanel():
         self.pl = parkingLot
 
     def inputInfoForTicket(self, pl: ParkingLot):
+        if pl.reservations is not None:
+            reservation = input("Type your reservation number or press Enter if you do not have one: ")
+            if reservation.isnumeric():
+                result = pl.reservations.checkIn(int(reservation), self.inputPet())
+                if result.ok:
+                    return result.ticket
+                print("There is no reservation to check in with that number.")
         vehicleType = 0
         while vehicleType != 1 and vehicleType != 2 and vehicleType != 3 and vehicleType != 4:
             vehicleType = input("What type of vehicle do you have? Press the number: 1. Car, 2. Truck, 3. Van, 4. Motorcycle ")
@@ -100,17 +1118,25 @@ class EntrancePanel():
         elif vehicleType == 4 and pl.freeSpotsMotorcycles == 0:
             return False
         
-        pd = ParkingDisplayBoard(self.pl)
-        pd.printParkingLot()
+        self.pl.parkingDisplayBoards[0].printParkingLot()
 
         spot = "000"
         while not(self.correctSpotCode(spot, vehicleType)):
-            spot = input("Choose where you want to park your vehicle: ")
-                #The first character should be the floor number (up to five); 
-                #the second character should be 'A', 'B', 'C', or 'D'; 
-                # and the third character should be the spot number (up to 10). 
-                # Section 'A' is for cars, 'B' for trucks, 'C' for vans, and 'D' for motorcycles. 
-                # Examples: 1A9 or 2D10 or 5B2.
+            spot = input("Choose where you want to park your vehicle (press Enter to get the nearest free spot): ")
+                #The first characters should be the floor number; 
+                #then the section letters as shown on the map ('A', 'B', ..., 'Z', 'AA', ...); 
+                # and then the spot number. 
+                # By default section 'A' is for cars, 'B' for trucks, 'C' for vans, and 'D' for motorcycles. 
+                # Examples: 1A9 or 2D10 or 12B140.
+            if spot == "":
+                spot = self.nearestSpotCode(vehicleType)
+        pet = self.inputPet()
+        result = pl.issueTicket(vehicleType, pet, spot)
+        if not result.ok:
+            return False
+        return result.ticket
+
+    def inputPet(self):
         pet = 0
         while pet != 1 and pet != 2:
             pet = input("Do you have a pet inside? Press the number: 1. Yes, 2. No ")
@@ -120,44 +1146,35 @@ class EntrancePanel():
                 print("Incorrect option")
         if(pet == 1): pet = True
         else: pet = False
-        return ParkingTicket(pl, vehicleType, pet, spot)
+        return pet
     
     def correctSpotCode(self, spot: str, vehType: int):
-        if len(spot) != 3 and len(spot) != 4:
-            return False
-        if int(spot[0]) < 0 or int(spot[0]) > len(self.pl.floors):
-            return False
-        if spot[1] != 'A' and spot[1] != 'B' and spot[1] != 'C' and spot[1] != 'D':
-            return False
-        if spot[2] != '1' and spot[2] != '2' and spot[2] != '3' and spot[2] != '4' and spot[2] != '5' and spot[2] != '6' and spot[2] != '7' and spot[2] != '8' and spot[2] != '9' and spot[2:] != "10":
-            return False
-        if not(spot[1] == 'A' and vehType == 1) and not(spot[1] == 'B' and vehType == 2) and not(spot[1] == 'C' and vehType == 3) and not(spot[1] == 'D' and vehType == 4):
+        status = self.pl.checkSpotCode(spot, VehicleType(vehType))
+        if status == GateStatus.WRONG_SECTION:
             print("Incorrect section. Type it again.")
             print()
-            return False
-        
-        temp = ord(spot[1]) - 65
-        if self.pl.floors[int(spot[0])-1].sections[temp].spots[int(spot[2:])-1].isFree == False:
+        elif status == GateStatus.SPOT_OCCUPIED:
             print("Invalid spot. It is already occupied.")
             print()
-            return False
-        return True
+        return status == GateStatus.OK
+
+    def nearestSpotCode(self, vehType: int):
+        #Looks up the nearest free spot without occupying it; issueTicket claims it.
+        found = self.pl.allocator.peek(VehicleType(vehType))
+        if found is None:
+            return "000"
+        fl, se, sp = found
+        return self.pl.floors[fl].sections[se].spots[sp].code()
     
     def spotCodeConverter(self, pt: ParkingTicket):
         #Change from human readable code to machine language code. Ex. 1B3 = floors[0], sections[1], spots[2] 
-        fl = int(pt.spot[0])-1
-        se = ord(pt.spot[1]) - 65
-        sp = int(pt.spot[2:])-1
-        return fl, se, sp
+        return parseSpotCode(pt.spot)
         
     def printTicket(self):
         ticket = self.inputInfoForTicket(self.pl)
         if ticket == False:
             print("Sorry, no more space. Follow the exit signs.")
             return 0
-        self.pl.tickets.append(ticket) #Add the new ticket to the parking lot system
-        fl, se, sp = self.spotCodeConverter(ticket)
-        self.pl.floors[fl].sections[se].spots[sp].isFree = False
         print()
         print("-----------------------------")
         print(f"Ticket number: {ticket.ticketNumber}")
@@ -167,6 +1184,9 @@ class EntrancePanel():
         print(f"Spot selected: {ticket.spot}")
         print(f"Pet inside: {ticket.pet}")
         print(ticket.payStatus)
+        if ticket.priceFactor != 1:
+            print(f"Rate: x{ticket.priceFactor:.2f}")
+        print(f"Ticket code: {ticket.token}")
         print("-----------------------------")
         print()
         self.openEntranceDoor()
@@ -175,30 +1195,117 @@ class EntrancePanel():
     def openEntranceDoor(self):
         print("Come in!")
     
+def loadNumpy():
+    #NumPy is optional and only imported when bulk pricing is used.
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+class Tariff():
+    #tiers: (hour, rate) pairs. Every completed hour from `hour` on costs `rate`, until the next tier starts.
+    #The default is the original price list: first hour free, 4 for the second, 3.5 for the third and
+    #fourth, 2.5 for every hour after that. The additional fee doubles the amount, or charges the
+    #minimum if the stay was free.
+    def __init__(self, tiers=((1, 4), (2, 3.5), (4, 2.5)), additionalFeeMinimum: float = 4, additionalFeeMultiplier: float = 2):
+        self.tiers = sorted(tiers)
+        self.additionalFeeMinimum = additionalFeeMinimum
+        self.additionalFeeMultiplier = additionalFeeMultiplier
+        self.bounds = []
+        for i, (start, rate) in enumerate(self.tiers):
+            end = self.tiers[i + 1][0] if i + 1 < len(self.tiers) else None
+            self.bounds.append((start, end, rate))
+        #Amount for every number of completed hours up to the start of the last tier; past that each
+        #hour adds the last rate, so price() is a table lookup.
+        self.table = [self.tierAmount(hours) for hours in range((self.tiers[-1][0] if self.tiers else 0) + 1)]
+        self.lastRate = self.tiers[-1][1] if self.tiers else 0
+
+    def tierAmount(self, hours: int):
+        amount = 0.0
+        for start, end, rate in self.bounds:
+            if hours < start:
+                break
+            last = hours if end is None else min(hours, end - 1)
+            amount += (last - start + 1) * rate
+        return amount
+
+    def price(self, seconds: float, additionalFee: bool = False):
+        hours = max(0, int(seconds // 3600))
+        if hours < len(self.table):
+            amount = self.table[hours]
+        else:
+            amount = self.table[-1] + (hours - len(self.table) + 1) * self.lastRate
+        if additionalFee:
+            if amount == 0:
+                amount = float(self.additionalFeeMinimum)
+            else:
+                amount = amount * self.additionalFeeMultiplier
+        return amount
+
+    def priceMany(self, seconds, additionalFees=None, factors=None):
+        #Prices a whole sequence of stays (in seconds) in one call, optionally each times its ticket's
+        #price factor. With NumPy this is vectorized and returns an array; without it, a list.
+        numpy = loadNumpy()
+        if numpy is None:
+            if additionalFees is None:
+                amounts = [self.price(s) for s in seconds]
+            else:
+                amounts = [self.price(s, f) for s, f in zip(seconds, additionalFees)]
+            if factors is not None:
+                amounts = [a * f for a, f in zip(amounts, factors)]
+            return amounts
+        hours = numpy.floor_divide(numpy.maximum(numpy.asarray(seconds, dtype=numpy.float64), 0), 3600)
+        amount = numpy.zeros(hours.shape)
+        for start, end, rate in self.bounds:
+            completed = numpy.maximum(hours - start + 1, 0)
+            if end is not None:
+                completed = numpy.minimum(completed, end - start)
+            amount += completed * rate
+        if additionalFees is not None:
+            fees = numpy.asarray(additionalFees, dtype=bool)
+            amount = numpy.where(fees, numpy.where(amount == 0, self.additionalFeeMinimum, amount * self.additionalFeeMultiplier), amount)
+        if factors is not None:
+            amount = amount * numpy.asarray(factors, dtype=numpy.float64)
+        return amount
+
+    def revenue(self, seconds, additionalFees=None, factors=None):
+        amounts = self.priceMany(seconds, additionalFees, factors)
+        if hasattr(amounts, "sum"):
+            return float(amounts.sum())
+        return float(sum(amounts))
+
+    def reprice(self, tickets):
+        #What paid tickets would have cost under this tariff.
+        paid = [t for t in tickets if t.payStatus == PaymentStatus.COMPLETED.name]
+        seconds = [(t.paidAtDate - t.issuedAtDate).total_seconds() for t in paid]
+        return self.priceMany(seconds, [t.additionalFee for t in paid], [t.priceFactor for t in paid])
+
+    def projectedRevenue(self, tickets, at=None):
+        #What the given (open) tickets would pay if they all left at `at`.
+        if at is None:
+            at = datetime.datetime.now()
+        tickets = list(tickets)
+        seconds = [(at - t.issuedAtDate).total_seconds() for t in tickets]
+        return self.revenue(seconds, [t.additionalFee for t in tickets], [t.priceFactor for t in tickets])
+
+DEFAULT_TARIFF = Tariff()
+
 class Payment():
-    def __init__(self, ticketCreationDate: str, additionalFee: bool):
+    def __init__(self, ticketCreationDate: str, additionalFee: bool, tariff: Tariff = None, clock=None, priceFactor: float = 1.0):
         self.ticketCreationDate = ticketCreationDate
         self.additionalFee = additionalFee
+        self.priceFactor = priceFactor
+        self.tariff = tariff if tariff is not None else DEFAULT_TARIFF
+        self.clock = clock if clock is not None else datetime.datetime.now
         self.amount = self.calculateAmountToPay()
+        self.method = PaymentMethod.CARD
 
     def calculateAmountToPay(self):
-        currentTime = datetime.datetime.now()
+        currentTime = self.clock()
         timeDifference = currentTime - self.ticketCreationDate
-        seconds = timeDifference.seconds
-        if seconds < 3600:
-            amount = 0
-        elif seconds >= 3600 and seconds < (3600 * 2):
-            amount = 4
-        elif seconds >= (3600 * 2) and seconds < (3600 * 4):
-            amount = (((seconds - 3600) // 3600) * 3.5) + 4
-        else:
-            amount = (((seconds - (3600 * 3)) // 3600) * 2.5) + 11
-
-        if amount == 0 and self.additionalFee == True:
-            amount = 4
-        elif amount > 0 and self.additionalFee == True:
-            amount = amount * 2
-        return amount
+        #total_seconds() keeps whole days; timedelta.seconds alone would bill 25 hours as 1.
+        return self.tariff.price(timeDifference.total_seconds(), self.additionalFee) * self.priceFactor
     
     def initiateTransaction(self):
         print(f"It is ${self.amount:.2f} dollars.")
@@ -206,6 +1313,7 @@ class Payment():
             paymentMethod = ''
             while paymentMethod != '1' and paymentMethod != '2':
                 paymentMethod = input("Type '1' for card payment and '2' for cash payment: ")
+            self.method = PaymentMethod(int(paymentMethod))
             if paymentMethod == '1':
                 cardName = input("Insert card: ")
             else:
@@ -225,31 +1333,36 @@ class ExitPanel():
     def scanTicket(self):
         valid = False
         while not valid:
-            ticketNum = int(input("Enter the ticket number: "))
-            for i in self.pl.tickets:
-                if i.ticketNumber == ticketNum and i.payStatus == PaymentStatus(1).name:
-                    valid = True
-                    payment = Payment(i.issuedAtDate, i.additionalFee)
-                    result = self.processPayment(payment)
-                    if result:
-                        i.payAmount = payment.amount
-                        i.payStatus = PaymentStatus(2).name
-                        i.paidAtDate = datetime.datetime.now()
-                        temp = ord(i.spot[1]) - 65
-                        self.pl.floors[int(i.spot[0])-1].sections[temp].spots[int(i.spot[2:])-1].isFree = True
-                        if temp == 0: self.pl.freeSpotsCars += 1
-                        elif temp == 1: self.pl.freeSpotsTrucks += 1
-                        elif temp == 2: self.pl.freeSpotsVans += 1
-                        else: self.pl.freeSpotsMotorcycles += 1
-                        self.openExitDoor()
-                    else: 
-                        print("We are sorry, but there was a problem during the transaction.")
+            #Either the ticket number or the code printed on the ticket; codes are checked by signature.
+            code = input("Enter the ticket number or scan the ticket code: ").strip()
+            i = None
+            if code.isnumeric():
+                i = self.pl.tickets.claim(int(code))
+            else:
+                decoded = self.pl.codec.decode(code)
+                if decoded is not None:
+                    i = self.pl.tickets.claim(decoded[0])
+            if i is not None:
+                valid = True
+                payment = Payment(i.issuedAtDate, i.additionalFee, self.pl.tariff, self.pl.clock, i.priceFactor)
+                try:
+                    result = self.processPayment(payment, i)
+                except BaseException:
+                    self.pl.tickets.unclaim(i)
+                    raise
+                if self.pl.finishCheckout(i, payment, result).ok:
+                    self.openExitDoor()
+                else: 
+                    print("We are sorry, but there was a problem during the transaction.")
                     
             if valid == False:
                 print("There is no unpaid ticket with that number.")
 
-    def processPayment(self, payment: Payment):
+    def processPayment(self, payment: Payment, ticket=None):
         payment.initiateTransaction()
+        if ticket is not None and not self.pl.authorize(ticket, payment):
+            print("The card was declined.")
+            return False
         return True
     
     def openExitDoor(self):
@@ -257,26 +1370,85 @@ class ExitPanel():
         print()
 
 class ParkingFloor():
-    def __init__(self, ident):
+    def __init__(self, ident, layout=defaultLayout(10)):
         self.id = ident
         self.sections = []
-        for i in "ABCD":
-            self.sections.append(ParkingSection(i, self.id))
+        for vehType, numSpots in layout:
+            self.addSection(vehType, numSpots)
+
+    def addSection(self, vehType: VehicleType, numSpots: int):
+        self.sections.append(ParkingSection(sectionName(len(self.sections)), self.id, numSpots, vehType))
+
+    def layout(self):
+        return tuple((section.vehicleType, len(section.spots)) for section in self.sections)
 
 class ParkingSection():
-    def __init__(self, ident, floor):
+    def __init__(self, ident, floor, numSpots: int = 10, vehType: VehicleType = None):
         self.id = ident
         self.floor = floor
-        self.spots = []
-        for i in range(1, 11):
-            if self.id == "A":
-                self.spots.append(ParkingSpot(i, self.id, self.floor, "CAR"))
-            elif self.id == "B":
-                self.spots.append(ParkingSpot(i, self.id, self.floor, "TRUCK"))
-            elif self.id == "C":
-                self.spots.append(ParkingSpot(i, self.id, self.floor, "VAN"))
-            else:
-                self.spots.append(ParkingSpot(i, self.id, self.floor, "MOTORCYCLE"))
+        #Without a vehicle type the original lettering applies: A cars, B trucks, C vans, D motorcycles.
+        self.vehicleType = vehType if vehType is not None else VehicleType(ord(ident) - 64)
+        self.spots = LazyList(self.newSpot, numSpots)
+
+    def newSpot(self, sp: int):
+        return ParkingSpot(sp + 1, self.id, self.floor, self.vehicleType.name)
+
+    def grow(self, extra: int):
+        self.spots.grow(extra)
+
+    def freeMask(self):
+        #Spots that were never created are free.
+        mask = (1 << len(self.spots)) - 1
+        if not self.spots.items:
+            return mask
+        for sp, spot in self.spots.built():
+            if not spot.isFree:
+                mask &= ~(1 << sp)
+        return mask
+
+class LazyList():
+    #Sequence of `count` items, item i being factory(i), made the first time it is accessed and kept.
+    #Stands in for the lists of spots, panels and display boards, so a lot costs the same to build
+    #however many of them it has.
+    __slots__ = ("factory", "count", "items")
+
+    def __init__(self, factory, count: int):
+        self.factory = factory
+        self.count = count
+        self.items = {}
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i: int):
+        if type(i) is slice:
+            return [self[j] for j in range(*i.indices(self.count))]
+        item = self.items.get(i)
+        if item is not None:
+            return item
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError("index out of range")
+        return self.items.setdefault(i, self.factory(i))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def grow(self, extra: int):
+        self.count += extra
+
+    def append(self, item):
+        self.items[self.count] = item
+        self.count += 1
+
+    def built(self):
+        #(index, item) of the items created so far.
+        return list(self.items.items())
 
 class ParkingSpot():
     def __init__(self, ident, section, floor, vehType):
@@ -286,6 +1458,121 @@ class ParkingSpot():
         self.isFree = True
         self.vehicleType = vehType
 
+    def code(self):
+        return f"{self.floor}{self.section}{self.id}"
+
+class OccupancyGrid():
+    #One byte per spot (1 = free). Every section owns a contiguous block, appended as floors and sections
+    #are added. A section that grows moves to a new block at the end; blocks of removed floors and moved
+    #sections are not reused.
+    def __init__(self):
+        self.free = bytearray()
+
+    def allocate(self, numSpots: int):
+        start = len(self.free)
+        self.free.extend(b"\x01" * numSpots)
+        return start
+
+class CompactFloor():
+    def __init__(self, ident, grid: OccupancyGrid, layout=defaultLayout(10)):
+        self.id = ident
+        self.grid = grid
+        self.sections = []
+        for vehType, numSpots in layout:
+            self.addSection(vehType, numSpots)
+
+    def addSection(self, vehType: VehicleType, numSpots: int):
+        self.sections.append(CompactSection(sectionName(len(self.sections)), self.id, self.grid, numSpots, vehType))
+
+    def layout(self):
+        return tuple((section.vehicleType, len(section.spots)) for section in self.sections)
+
+class CompactSection():
+    def __init__(self, ident, floor, grid: OccupancyGrid, numSpots: int = 10, vehType: VehicleType = None):
+        self.id = ident
+        self.floor = floor
+        self.vehicleType = vehType if vehType is not None else VehicleType(ord(ident) - 64)
+        self.spots = CompactSpots(self, grid, numSpots)
+
+    def grow(self, extra: int):
+        #Caller holds the floor lock, so no spot of the section changes while its block is copied.
+        spots = self.spots
+        start = spots.grid.allocate(len(spots) + extra)
+        spots.grid.free[start:start + len(spots)] = spots.grid.free[spots.start:spots.start + len(spots)]
+        spots.start = start
+        spots.length += extra
+
+    def freeMask(self):
+        start = self.spots.start
+        block = self.spots.grid.free[start:start + len(self.spots)]
+        if block.count(0) == 0:
+            return (1 << len(block)) - 1
+        mask = 0
+        for sp, free in enumerate(block):
+            if free:
+                mask |= 1 << sp
+        return mask
+
+class CompactSpots():
+    #Sequence of spot views over the grid. Views are created on access, so a section costs a few
+    #objects no matter how many spots it has.
+    __slots__ = ("section", "grid", "start", "length")
+
+    def __init__(self, section: CompactSection, grid: OccupancyGrid, numSpots: int):
+        self.section = section
+        self.grid = grid
+        self.start = grid.allocate(numSpots)
+        self.length = numSpots
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, sp: int):
+        if sp < 0:
+            sp += len(self)
+        if sp < 0 or sp >= len(self):
+            raise IndexError("spot index out of range")
+        return CompactSpot(self, sp)
+
+    def __iter__(self):
+        for sp in range(len(self)):
+            yield CompactSpot(self, sp)
+
+class CompactSpot():
+    #Lightweight view with the same attributes as ParkingSpot; isFree reads and writes the grid.
+    __slots__ = ("spots", "index")
+
+    def __init__(self, spots: CompactSpots, index: int):
+        self.spots = spots
+        self.index = index
+
+    @property
+    def id(self):
+        return self.index + 1
+
+    @property
+    def section(self):
+        return self.spots.section.id
+
+    @property
+    def floor(self):
+        return self.spots.section.floor
+
+    @property
+    def vehicleType(self):
+        return self.spots.section.vehicleType.name
+
+    @property
+    def isFree(self):
+        return self.spots.grid.free[self.spots.start + self.index] == 1
+
+    @isFree.setter
+    def isFree(self, value: bool):
+        self.spots.grid.free[self.spots.start + self.index] = 1 if value else 0
+
+    def code(self):
+        return f"{self.floor}{self.section}{self.id}"
+
 class Account():
     def __init__(self, parkingLot: ParkingLot, username: str, password: str):
         self.pl = parkingLot
@@ -297,107 +1584,139 @@ class Account():
         self.pl.parkingDisplayBoards[0].printParkingLot()
 
 class ParkingAttendant(Account):
-    def checkTickets(self):
-        for i in self.pl.tickets:
-            print("-----------------------------")
-            print(f"Ticket number: {i.ticketNumber}")
-            print(f"Vehicle type: {i.vehicleType.name}")
-            print(f"Spot: {i.spot}")
-            print(f"Pet: {i.pet}")
-            print(f"Issued at date: {i.issuedAtDate}")
-            print(f"Paid at date: {i.paidAtDate}")
-            print(f"Fee: ${i.payAmount:.02f}")
-            print(f"Payment status: {i.payStatus}")
-            print(f"Additional fee: {i.additionalFee}")
-            print("-----------------------------")
+    def checkTickets(self, page: int = 1, pageSize: int = 20):
+        #Prints one page of tickets in issue order. Returns True if there are more pages.
+        #The page is formatted first and written with a single print.
+        tickets = self.pl.tickets.page((page - 1) * pageSize, pageSize + 1)
+        lines = []
+        for i in tickets[:pageSize]:
+            lines.append("-----------------------------")
+            lines.append(f"Ticket number: {i.ticketNumber}")
+            lines.append(f"Vehicle type: {i.vehicleType.name}")
+            lines.append(f"Spot: {i.spot}")
+            lines.append(f"Pet: {i.pet}")
+            lines.append(f"Issued at date: {i.issuedAtDate}")
+            lines.append(f"Paid at date: {i.paidAtDate}")
+            lines.append(f"Fee: ${i.payAmount:.02f}")
+            lines.append(f"Payment status: {i.payStatus}")
+            lines.append(f"Additional fee: {i.additionalFee}")
+            lines.append("-----------------------------")
+        if lines:
+            print("\n".join(lines))
+        return len(tickets) > pageSize
 
     def addAdditionalFee(self, ticket: ParkingTicket):
-        ticket.additionalFee = True
+        with self.pl.journalLock:
+            ticket.additionalFee = True
+            self.pl.tickets.update(ticket)
+            self.pl.record("F", ticket.ticketNumber, True)
     
     def removeAdditionalFee(self, ticket: ParkingTicket):
-        ticket.additionalFee = False
+        with self.pl.journalLock:
+            ticket.additionalFee = False
+            self.pl.tickets.update(ticket)
+            self.pl.record("F", ticket.ticketNumber, False)
 
     def checkNumOfFreeSpots(self):
         print(f"A: {self.pl.freeSpotsCars}, B: {self.pl.freeSpotsTrucks}, C: {self.pl.freeSpotsVans}, D: {self.pl.freeSpotsMotorcycles}")
 
 class Admin(Account):
-    def addParkingFloor(self):
-        if len(self.pl.floors) < 9:
-            temp = self.pl.floors[-1].id + 1
-            self.pl.floors.append(ParkingFloor(temp))
-            self.pl.numEntrancePanels += 2
-            self.pl.numExitPanels += 2
-            for i in range(1, 3):
-                temp = self.pl.entrancePanels[-1].id + 1
-                self.pl.entrancePanels.append(EntrancePanel(temp, self.pl))
-                temp = self.pl.exitPanels[-1].id + 1
-                self.pl.entrancePanels.append(ExitPanel(temp, self.pl))
-            self.pl.totalSpots += 40
-            self.pl.freeSpotsCars += 10
-            self.pl.freeSpotsTrucks += 10
-            self.pl.freeSpotsVans += 10
-            self.pl.freeSpotsMotorcycles += 10
-            self.pl.numParkingDisplayBoards += 1
-            self.pl.parkingDisplayBoards.append(ParkingDisplayBoard(self.pl))
+    def addParkingFloor(self, layout=None):
+        if self.pl.addParkingFloor(layout):
             print("The new floor has been added.")
         else:
             print("No more floors can be added.")
 
+    def removeParkingFloor(self, floorId: int):
+        remaining = self.pl.removeParkingFloor(floorId)
+        if remaining is None:
+            print("That floor does not exist.")
+        elif remaining == 0:
+            print(f"Floor {floorId} has been removed.")
+        else:
+            print(f"Floor {floorId} is closed and will be removed when the last {remaining} vehicles have left.")
+
     def blockParkingAttendant(self):
-        self.pl.parkingAttendant.status = AccountStatus(2).name
+        with self.pl.journalLock:
+            self.pl.parkingAttendant.status = AccountStatus(2).name
+            self.pl.recordAttendant()
 
     def unblockParkingAttendant(self):
-        self.pl.parkingAttendant.status = AccountStatus(1).name
+        with self.pl.journalLock:
+            self.pl.parkingAttendant.status = AccountStatus(1).name
+            self.pl.recordAttendant()
 
     def replaceParkingAttendant(self, username: str, password: str):
-        self.pl.parkingAttendant.username = username
-        self.pl.parkingAttendant.password = password
+        with self.pl.journalLock:
+            self.pl.parkingAttendant.username = username
+            self.pl.parkingAttendant.password = password
+            self.pl.recordAttendant()
 
 class ParkingDisplayBoard():
+    #Renders straight from the allocator bitmaps and keeps each floor's text until the allocator bumps
+    #that floor's version, so a redraw only re-renders floors where a spot changed. Output is written
+    #with a single print call.
     def __init__(self, parkingLot: ParkingLot):
         self.pl = parkingLot
+        self.renderedFloors = {}
+        self.tokens = {}
+
+    def spotTokens(self, numSpots: int):
+        if numSpots not in self.tokens:
+            free = [f"{i + 1} " for i in range(numSpots)]
+            occupied = ["X " if i < 9 else " X " for i in range(numSpots)]
+            self.tokens[numSpots] = (free, occupied)
+        return self.tokens[numSpots]
+
+    def renderLabels(self, floor: ParkingFloor):
+        return "".join(section.id + "\t" * 4 for section in floor.sections) + "\n"
+
+    def renderSection(self, floor: int, section: int):
+        numSpots = len(self.pl.floors[floor].sections[section].spots)
+        free, occupied = self.spotTokens(numSpots)
+        allocator = self.pl.allocator
+        if allocator.sectionFree[floor][section] == numSpots:
+            parts = free
+        elif allocator.sectionFree[floor][section] == 0:
+            parts = occupied
+        else:
+            bits = format(allocator.spotMasks[floor][section], f"0{numSpots}b")[::-1][:numSpots]
+            parts = [free[i] if bit == "1" else occupied[i] for i, bit in enumerate(bits)]
+        return "{ " + "".join(parts) + "}\t"
+
+    def renderFloor(self, floor: int):
+        version = self.pl.allocator.floorVersions[floor]
+        cached = self.renderedFloors.get(floor)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        parkingFloor = self.pl.floors[floor]
+        closed = "" if self.pl.allocator.active[floor] else " (closed)"
+        parts = [f"Floor {parkingFloor.id}{closed}\n", self.renderLabels(parkingFloor)]
+        #While a drained floor is rebuilt the allocator may briefly have fewer sections than the floor.
+        for i in range(min(len(parkingFloor.sections), len(self.pl.allocator.sectionFree[floor]))):
+            parts.append(self.renderSection(floor, i))
+        parts.append("\n")
+        text = "".join(parts)
+        self.renderedFloors[floor] = (version, text)
+        return text
 
     def printLabels(self):
-        for i in range(0, 4):
-            for j in range(0, 5):
-                if j != 0:
-                    print("\t", end="")
-                else:
-                    if i == 0:
-                        print("A", end="")
-                    elif i == 1:
-                        print("B", end="")
-                    elif i == 2:
-                        print("C", end="")
-                    else:
-                        print("D", end="")
-        print()
+        print(self.renderLabels(self.pl.floors[0]), end="")
 
     def printSectionSpotNumbers(self, floor: int, section: int):
-        print("{", end=" ")
-        for i in range(0, 10):
-            if self.pl.floors[floor].sections[section].spots[i].isFree == True:
-                print(i + 1, end=" ")
-            else:
-                if i == 9:
-                    print(" X", end=" ")
-                else:
-                    print("X", end=" ")
-        print("}", end="\t")
+        print(self.renderSection(floor, section), end="")
 
     def printFloor(self, floor: ParkingFloor):
-        print(f"Floor {floor.id}")
-        self.printLabels()
-        for i in range(0, 4):
-            self.printSectionSpotNumbers((floor.id - 1), i)
-            if i == 3:
-                print()
+        print(self.renderFloor(floor.id - 1), end="")
 
     def printParkingLot(self):
-        print()
+        parts = ["\n"]
         for i in reversed(range(0, len(self.pl.floors))):
-            self.printFloor(self.pl.floors[i])
-            print()
+            if not self.pl.floors[i].sections:
+                continue
+            parts.append(self.renderFloor(i))
+            parts.append("\n")
+        print("".join(parts), end="")
 
 class AdminPortal():
     def __init__(self, pl: ParkingLot):
@@ -409,8 +1728,8 @@ class AdminPortal():
         if pw == self.admin.password:
             while(True):
                 while(True):
-                    option = input("Choose one of the following options: '1' to add a new parking floor, '2' to see the map of the parking lot, '3' to block a parking attendant, '4' to unblock a parking attendant, '5' to replace the parking attendant, and '6' to exit: ")
-                    if option == '1' or option == '2' or option == '3' or option == '4' or option == '5' or option == '6':
+                    option = input("Choose one of the following options: '1' to add a new parking floor, '2' to see the map of the parking lot, '3' to block a parking attendant, '4' to unblock a parking attendant, '5' to replace the parking attendant, '6' to remove a parking floor, and '7' to exit: ")
+                    if option == '1' or option == '2' or option == '3' or option == '4' or option == '5' or option == '6' or option == '7':
                         break
                 if option == '1':
                     self.admin.addParkingFloor()
@@ -435,6 +1754,12 @@ class AdminPortal():
                     password = input("Type the password of the new parking attendant: ")
                     self.admin.replaceParkingAttendant(newName, password)
                     print("The parking attendant has been replaced.")
+                elif option == '6':
+                    floor = input("Type the number of the floor to remove: ")
+                    if floor.isnumeric():
+                        self.admin.removeParkingFloor(int(floor))
+                    else:
+                        print("That floor does not exist.")
                 else:
                     break
         else:
@@ -455,7 +1780,11 @@ class ParkingAttendantPortal():
                         if option == '1' or option == '2' or option == '3' or option == '4' or option == '5' or option == '6':
                             break
                     if option == '1':
-                        self.parkingAttendant.checkTickets()
+                        page = 1
+                        while self.parkingAttendant.checkTickets(page):
+                            if input("Press Enter to see more tickets or type 'q' to stop: ") == 'q':
+                                break
+                            page += 1
                     elif option == '2':
                         self.parkingAttendant.checkMapOfParkingLot()
                     elif option == '3':
@@ -464,44 +1793,45 @@ class ParkingAttendantPortal():
                         ticketNum = input("What is the ticket number: ")
                         if ticketNum.isnumeric():
                             ticketNum = int(ticketNum)
-                            for i in self.pl.tickets:
-                                if i.ticketNumber == ticketNum and i.additionalFee == False and i.payStatus == PaymentStatus(1).name:
-                                    self.parkingAttendant.addAdditionalFee(i)
-                                    print("The additional fee has been added.")
+                            i = self.pl.tickets.getOpen(ticketNum)
+                            if i is not None and i.additionalFee == False:
+                                self.parkingAttendant.addAdditionalFee(i)
+                                print("The additional fee has been added.")
                     elif option == '5':
                         ticketNum = input("What is the ticket number: ")
                         if ticketNum.isnumeric():
                             ticketNum = int(ticketNum)
-                            for i in self.pl.tickets:
-                                if i.ticketNumber == ticketNum and i.additionalFee == True and i.payStatus == PaymentStatus(1).name:
-                                    self.parkingAttendant.removeAdditionalFee(i)
-                                    print("The additional fee has been removed.")
+                            i = self.pl.tickets.getOpen(ticketNum)
+                            if i is not None and i.additionalFee == True:
+                                self.parkingAttendant.removeAdditionalFee(i)
+                                print("The additional fee has been removed.")
                     else:
                         break
             else: print("You are not allowed to log in.")
         else:
             print("Failed")
 
-#Examples:
-PL = ParkingLot("Ensenada, Baja California", "Pepe", "flymetothemoon")
-adm = Admin(PL, "Pepe", "flymetothemoon")
-adm.replaceParkingAttendant("Juan", "Iusedtoruletheworld")
-PL.parkingAttendant.checkMapOfParkingLot()
-adm.addParkingFloor()
-print(f"Number of floors: {len(PL.floors)}")
-for i in range(0, 2):
+if __name__ == "__main__":
+    #Examples:
+    PL = ParkingLot("Ensenada, Baja California", "Pepe", "flymetothemoon")
+    adm = Admin(PL, "Pepe", "flymetothemoon")
+    adm.replaceParkingAttendant("Juan", "Iusedtoruletheworld")
+    PL.parkingAttendant.checkMapOfParkingLot()
+    adm.addParkingFloor()
+    print(f"Number of floors: {len(PL.floors)}")
+    for i in range(0, 2):
+        PL.entrancePanels[0].printTicket()
+    PL.parkingAttendant.checkNumOfFreeSpots()
+    PL.parkingAttendant.addAdditionalFee(PL.tickets[0])
+    PL.parkingAttendant.checkTickets()
+    PL.exitPanels[0].scanTicket()
+    PL.parkingAttendant.checkNumOfFreeSpots()
     PL.entrancePanels[0].printTicket()
-PL.parkingAttendant.checkNumOfFreeSpots()
-PL.parkingAttendant.addAdditionalFee(PL.tickets[0])
-PL.parkingAttendant.checkTickets()
-PL.exitPanels[0].scanTicket()
-PL.parkingAttendant.checkNumOfFreeSpots()
-PL.entrancePanels[0].printTicket()
-PL.parkingAttendant.checkNumOfFreeSpots()
-PL.admin.checkMapOfParkingLot()
-
-adminPortal = AdminPortal(PL)
-adminPortal.menu()
-
-parkingAttendantPortal = ParkingAttendantPortal(PL)
-parkingAttendantPortal.menu()
+    PL.parkingAttendant.checkNumOfFreeSpots()
+    PL.admin.checkMapOfParkingLot()
+
+    adminPortal = AdminPortal(PL)
+    adminPortal.menu()
+
+    parkingAttendantPortal = ParkingAttendantPortal(PL)
+    parkingAttendantPortal.menu()
@@ -0,0 +1,208 @@
+from enum import Enum
+import asyncio
+import concurrent.futures
+import itertools
+import os
+import random
+import threading
+from parkinglot import ParkingLot
+
+class AuthorizationStatus(Enum):
+    APPROVED = 1
+    DECLINED = 2
+    ERROR = 3
+    TIMEOUT = 4
+
+#Gateway interface: any object with these two coroutines can be plugged into a PaymentProcessor.
+#  async authorize(requests) -> [AuthorizationStatus]  for [(key, reference, amount)], one status per request
+#  async refund(requests) -> [AuthorizationStatus]
+#ERROR means the attempt failed and can be retried; DECLINED is final. key is an idempotency key, the
+#same on every retry of a request: the gateway must charge (or refund) a key at most once and answer a
+#repeated key with the outcome it already decided, since a timed-out attempt may have gone through.
+
+class FakeGateway():
+    #Local stand-in for a card processor. Each batch takes latency (+ up to jitter) seconds; each request
+    #is declined with declineRate and fails transiently with errorRate; with hangRate the whole batch is
+    #processed but never answered, which the processor sees as a timeout. Keys already approved or
+    #declined get the same answer again without a new charge; `charged` counts the approved keys.
+    def __init__(self, latency: float = 0.05, jitter: float = 0, declineRate: float = 0.02, errorRate: float = 0.01, hangRate: float = 0, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.declineRate = declineRate
+        self.errorRate = errorRate
+        self.hangRate = hangRate
+        self.rng = random.Random(seed)
+        self.batches = 0
+        self.requests = 0
+        self.charged = 0
+        self.outcomes = {}
+
+    async def answer(self, requests: list, declineRate: float):
+        self.batches += 1
+        self.requests += len(requests)
+        hang = self.rng.random() < self.hangRate
+        statuses = []
+        for key, reference, amount in requests:
+            if key in self.outcomes:
+                statuses.append(self.outcomes[key])
+                continue
+            draw = self.rng.random()
+            if draw < self.errorRate:
+                statuses.append(AuthorizationStatus.ERROR)
+                continue
+            status = AuthorizationStatus.DECLINED if draw < self.errorRate + declineRate else AuthorizationStatus.APPROVED
+            self.outcomes[key] = status
+            if status == AuthorizationStatus.APPROVED:
+                self.charged += 1
+            statuses.append(status)
+        if hang:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(self.latency + self.rng.random() * self.jitter)
+        return statuses
+
+    async def authorize(self, requests: list):
+        return await self.answer(requests, self.declineRate)
+
+    async def refund(self, requests: list):
+        return await self.answer(requests, 0)
+
+class PaymentProcessor():
+    #Queues card authorizations and refunds and sends them to the gateway in batches: a batch goes out
+    #once it has batchSize requests or its oldest request has waited maxDelay seconds. Up to `concurrency`
+    #batches are in flight at once. A batch that times out, and every request in it that comes back
+    #ERROR, is retried up to `retries` times with a growing backoff; after that the request counts as
+    #not approved. Every request carries an idempotency key that its retries reuse, so a retried timeout
+    #cannot charge twice. Everything runs on the processor's own event loop thread. Callers get a
+    #concurrent.futures.Future, so a gate only ever waits for its own payment: console and programmatic
+    #gates block on .result(), asyncio gates await asyncio.wrap_future().
+    def __init__(self, pl: ParkingLot, gateway, batchSize: int = 50, maxDelay: float = 0.01, timeout: float = 2.0, retries: int = 3, backoff: float = 0.05, concurrency: int = 8):
+        self.pl = pl
+        self.gateway = gateway
+        self.batchSize = batchSize
+        self.maxDelay = maxDelay
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.concurrency = concurrency
+        self.results = {status: 0 for status in AuthorizationStatus}
+        #Idempotency keys: unique per processor run, then numbered.
+        self.keyPrefix = os.urandom(6).hex()
+        self.keys = itertools.count(1)
+        #Once closed, new requests are answered as not approved without reaching the loop.
+        self.closed = False
+        self.lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.started.wait()
+        pl.payments = self
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.queues = {"authorize": asyncio.Queue(), "refund": asyncio.Queue()}
+        self.slots = asyncio.Semaphore(self.concurrency)
+        for kind in self.queues:
+            self.loop.create_task(self.batchLoop(kind))
+        self.started.set()
+        self.loop.run_forever()
+        #Stopped by close(): requests still queued or in flight are answered as not approved.
+        for queue in self.queues.values():
+            while not queue.empty():
+                self.finish(queue.get_nowait(), AuthorizationStatus.ERROR)
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def submit(self, kind: str, reference, amount: float):
+        #Thread-safe; the future resolves to True (approved) or False.
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.closed:
+                future.set_result(False)
+                return future
+            key = f"{self.keyPrefix}-{next(self.keys)}"
+            self.loop.call_soon_threadsafe(self.queues[kind].put_nowait, (key, reference, amount, future))
+        return future
+
+    def authorize(self, reference, amount: float):
+        return self.submit("authorize", reference, amount)
+
+    def refund(self, reference, amount: float):
+        return self.submit("refund", reference, amount)
+
+    async def batchLoop(self, kind: str):
+        queue = self.queues[kind]
+        batch = []
+        try:
+            while True:
+                batch = [await queue.get()]
+                deadline = self.loop.time() + self.maxDelay
+                while len(batch) < self.batchSize:
+                    remaining = deadline - self.loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                await self.slots.acquire()
+                self.loop.create_task(self.sendBatch(kind, batch))
+                batch = []
+        except asyncio.CancelledError:
+            #Cancelled by close() while collecting a batch or waiting for a slot.
+            for request in batch:
+                self.finish(request, AuthorizationStatus.ERROR)
+            raise
+
+    async def sendBatch(self, kind: str, batch: list):
+        call = self.gateway.authorize if kind == "authorize" else self.gateway.refund
+        try:
+            pending = batch
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    await asyncio.sleep(self.backoff * attempt)
+                try:
+                    statuses = await asyncio.wait_for(call([(key, reference, amount) for key, reference, amount, future in pending]), self.timeout)
+                except asyncio.TimeoutError:
+                    statuses = [AuthorizationStatus.TIMEOUT] * len(pending)
+                retry = []
+                for request, status in zip(pending, statuses):
+                    if status in (AuthorizationStatus.ERROR, AuthorizationStatus.TIMEOUT) and attempt < self.retries:
+                        retry.append(request)
+                    else:
+                        self.finish(request, status)
+                pending = retry
+                if not pending:
+                    break
+        except Exception as error:
+            #A broken gateway must not leave gates waiting forever.
+            for key, reference, amount, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        except asyncio.CancelledError:
+            for request in batch:
+                self.finish(request, AuthorizationStatus.ERROR)
+            raise
+        finally:
+            self.slots.release()
+
+    def finish(self, request: tuple, status: AuthorizationStatus):
+        key, reference, amount, future = request
+        if not future.done():
+            self.results[status] += 1
+            future.set_result(status == AuthorizationStatus.APPROVED)
+
+    def close(self):
+        #Checkouts from now on run as in a lot without a processor. Requests submitted before this are queued
+        #ahead of the stop, so run() answers every one of them.
+        if self.pl.payments is self:
+            self.pl.payments = None
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -0,0 +1,70 @@
+import datetime
+import math
+from parkinglot import ParkingLot, VehicleType
+
+#Occupancy bands: (occupancy from, multiplier), occupancy being the share of a vehicle type's spots in use.
+DEFAULT_BANDS = ((0, 1.0), (0.5, 1.1), (0.8, 1.3), (0.95, 1.6))
+#Multiplier by hour of entry: cheaper at night, dearer at the morning and evening peaks.
+DEFAULT_HOURS = tuple(0.8 if hour < 6 else 1.2 if 7 <= hour < 10 or 16 <= hour < 19 else 1.0 for hour in range(24))
+
+class DynamicPricing():
+    #Sets each ticket's price factor at entry from how full its vehicle type is and the hour. The lot's
+    #tariff times the factor is what the ticket pays, so the price is locked in when the ticket is issued.
+    #For every vehicle type the current band and its 24 hourly factors are cached, together with the range
+    #of free spot counts the band covers. factor() only compares the live freeSpots* counter with that
+    #range and indexes the table; the table is rebuilt when the counter leaves the range (or the capacity changes).
+    def __init__(self, pl: ParkingLot, bands=DEFAULT_BANDS, hourMultipliers=DEFAULT_HOURS, typeMultipliers: dict = None):
+        self.pl = pl
+        self.bands = sorted(bands)
+        self.hourMultipliers = tuple(hourMultipliers)
+        self.typeMultipliers = typeMultipliers if typeMultipliers is not None else {}
+        self.tables = {vt: (0, -1, -1, ()) for vt in VehicleType}
+        self.rebuilds = 0
+        pl.pricing = self
+
+    def capacity(self, vehType: VehicleType):
+        #Spots of the type on open floors; changes when floors are added, grown or drained.
+        return self.pl.capacity(vehType)
+
+    def freeLimit(self, capacity: int, threshold: float):
+        #Most free spots at which the occupancy is still at least threshold (capacity 100, 0.8 -> 20).
+        #Choosing the band and caching its range both go through this one integer test, so they agree at
+        #the boundaries; the epsilon absorbs float error in capacity * threshold.
+        return math.floor(capacity - capacity * threshold + 1e-9)
+
+    def bandIndex(self, capacity: int, free: int):
+        band = 0
+        while band + 1 < len(self.bands) and free <= self.freeLimit(capacity, self.bands[band + 1][0]):
+            band += 1
+        return band
+
+    def rebuild(self, vehType: VehicleType, free: int):
+        capacity = self.capacity(vehType)
+        band = self.bandIndex(capacity, free)
+        #Free counts that keep the occupancy inside this band.
+        highest = capacity if band == 0 else self.freeLimit(capacity, self.bands[band][0])
+        lowest = 0 if band + 1 == len(self.bands) else self.freeLimit(capacity, self.bands[band + 1][0]) + 1
+        multiplier = self.bands[band][1] * self.typeMultipliers.get(vehType, 1.0)
+        table = tuple(round(multiplier * hourly, 3) for hourly in self.hourMultipliers)
+        self.tables[vehType] = (capacity, lowest, highest, table)
+        self.rebuilds += 1
+        return table
+
+    def factor(self, vehicleType, at: datetime.datetime = None):
+        vehType = VehicleType(vehicleType)
+        if at is None:
+            at = self.pl.clock()
+        free = self.pl.freeSpots(vehType)
+        capacity, lowest, highest, table = self.tables[vehType]
+        if not lowest <= free <= highest or capacity != self.capacity(vehType):
+            table = self.rebuild(vehType, free)
+        return table[at.hour]
+
+    def band(self, vehicleType):
+        #Index of the occupancy band the vehicle type is in right now.
+        vehType = VehicleType(vehicleType)
+        return self.bandIndex(self.capacity(vehType), self.pl.freeSpots(vehType))
+
+    def quote(self, vehicleType, hours: float, additionalFee: bool = False, at: datetime.datetime = None):
+        #What a stay of `hours` would cost for a vehicle entering now (or at `at`).
+        return self.pl.tariff.price(hours * 3600, additionalFee) * self.factor(vehicleType, at)
@@ -0,0 +1,107 @@
+import csv
+import json
+from parkinglot import VehicleType, PaymentStatus
+
+#Reports are built from generators over store.scan(), so a report or export holds one chunk of tickets
+#at a time no matter how much history the store has. Works with any ticket store (TicketStore,
+#sqlitestore.SQLiteTicketStore).
+
+FIELDS = ("ticketNumber", "vehicleType", "spot", "pet", "issuedAtDate", "paidAtDate", "payAmount", "payStatus", "additionalFee", "priceFactor")
+
+def streamTickets(store, start=None, end=None, status: PaymentStatus = None, vehicleType: VehicleType = None, additionalFee: bool = None, chunkSize: int = 1000):
+    #Tickets issued in [start, end) in issue order, optionally only those with the given payment status,
+    #vehicle type or additional fee.
+    statusName = None if status is None else PaymentStatus(status).name
+    vehType = None if vehicleType is None else VehicleType(vehicleType)
+    for chunk in store.scan(start, end, chunkSize):
+        for ticket in chunk:
+            if statusName is not None and ticket.payStatus != statusName:
+                continue
+            if vehType is not None and ticket.vehicleType != vehType:
+                continue
+            if additionalFee is not None and ticket.additionalFee != additionalFee:
+                continue
+            yield ticket
+
+def chunked(tickets, chunkSize: int = 1000):
+    chunk = []
+    for ticket in tickets:
+        chunk.append(ticket)
+        if len(chunk) >= chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class TicketSummary():
+    #Running totals filled in one pass by add(). Revenue is counted on the day the ticket was paid,
+    #dwell time only for paid tickets; cancelled and refunded tickets bring no revenue.
+    def __init__(self):
+        self.tickets = 0
+        self.paid = 0
+        self.revenue = 0.0
+        self.revenuePerDay = {}
+        self.revenuePerType = {vt: 0.0 for vt in VehicleType}
+        self.ticketsPerType = {vt: 0 for vt in VehicleType}
+        self.additionalFees = 0
+        self.dwellSeconds = 0.0
+
+    def add(self, ticket):
+        self.tickets += 1
+        self.ticketsPerType[ticket.vehicleType] += 1
+        if ticket.additionalFee:
+            self.additionalFees += 1
+        if ticket.payStatus == PaymentStatus.COMPLETED.name:
+            self.paid += 1
+            self.revenue += ticket.payAmount
+            self.revenuePerType[ticket.vehicleType] += ticket.payAmount
+            day = ticket.paidAtDate.date()
+            self.revenuePerDay[day] = self.revenuePerDay.get(day, 0.0) + ticket.payAmount
+            self.dwellSeconds += (ticket.paidAtDate - ticket.issuedAtDate).total_seconds()
+
+    def averageDwell(self):
+        #In seconds, over paid tickets.
+        if self.paid == 0:
+            return 0.0
+        return self.dwellSeconds / self.paid
+
+    def printSummary(self):
+        lines = [f"Tickets: {self.tickets} ({self.paid} paid, {self.additionalFees} with additional fee)"]
+        lines.append(f"Revenue: ${self.revenue:.02f}")
+        lines.append(f"Average stay: {self.averageDwell() / 3600:.02f} hours")
+        for vt in VehicleType:
+            lines.append(f"{vt.name}: {self.ticketsPerType[vt]} tickets, ${self.revenuePerType[vt]:.02f}")
+        for day in sorted(self.revenuePerDay):
+            lines.append(f"{day}: ${self.revenuePerDay[day]:.02f}")
+        print("\n".join(lines))
+
+def summarize(tickets):
+    summary = TicketSummary()
+    for ticket in tickets:
+        summary.add(ticket)
+    return summary
+
+def ticketRow(ticket):
+    paidAt = ticket.paidAtDate.isoformat() if ticket.paidAtDate != "" else ""
+    return (ticket.ticketNumber, ticket.vehicleType.name, ticket.spot, ticket.pet, ticket.issuedAtDate.isoformat(), paidAt, ticket.payAmount, ticket.payStatus, ticket.additionalFee, ticket.priceFactor)
+
+def exportCSV(tickets, path: str, chunkSize: int = 1000):
+    #Writes the tickets with a header row, one chunk per writerows call. Returns the number written.
+    count = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        for chunk in chunked(tickets, chunkSize):
+            writer.writerows([ticketRow(t) for t in chunk])
+            count += len(chunk)
+    return count
+
+def exportJSONL(tickets, path: str, chunkSize: int = 1000):
+    #One JSON object per line, keys as in FIELDS. Returns the number written.
+    count = 0
+    encoder = json.JSONEncoder(separators=(",", ":"))
+    with open(path, "w") as f:
+        for chunk in chunked(tickets, chunkSize):
+            f.write("".join([encoder.encode(dict(zip(FIELDS, ticketRow(t)))) + "\n" for t in chunk]))
+            count += len(chunk)
+    return count
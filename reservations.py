@@ -0,0 +1,294 @@
+from enum import Enum
+import bisect
+import datetime
+import heapq
+import threading
+from parkinglot import ParkingLot, VehicleType, GateStatus, EntryResult, highestBit, parseSpotCode
+
+class ReservationStatus(Enum):
+    BOOKED = 1
+    HELD = 2
+    CHECKED_IN = 3
+    COMPLETED = 4
+    CANCELLED = 5
+    NO_SHOW = 6
+    UNAVAILABLE = 7
+
+class Reservation():
+    def __init__(self, ident: int, vehType: VehicleType, fl: int, se: int, sp: int, start: datetime.datetime, end: datetime.datetime):
+        self.id = ident
+        self.vehicleType = vehType
+        self.fl = fl
+        self.se = se
+        self.sp = sp
+        self.start = start
+        self.end = end
+        self.status = ReservationStatus.BOOKED
+        self.ticketNumber = None
+
+class ReservationBook():
+    #Reservations are booked in whole slots (slotMinutes). Every spot has a timeline: a sorted list of its
+    #booked (start, end, id) intervals, so checking one spot is a binary search. Finding *any* spot uses
+    #the availability index instead of the timelines: for every section, a bitmap of reserved spots per
+    #slot. OR-ing the slots of the window gives the section's reserved spots, so a query costs
+    #O(floors x slots in the window) bitmap operations however many spots there are.
+    #Walk-ins and reservations share the allocator: leadTime before its start a reservation is held, i.e.
+    #its spot is claimed like any occupied spot, so walk-ins can no longer take it. If a walk-in is still
+    #parked there at that point, the reservation moves to another spot that is free for the whole window.
+    #An unused hold is released when the reservation ends, and checking out early frees the rest of the window.
+    def __init__(self, pl: ParkingLot, slotMinutes: int = 15, leadTime: datetime.timedelta = datetime.timedelta(minutes=30)):
+        self.pl = pl
+        self.slotSeconds = slotMinutes * 60
+        self.leadTime = leadTime
+        self.reservations = {}
+        self.timelines = {}
+        self.slotMasks = {}
+        self.byTicket = {}
+        self.holds = []
+        self.expiries = []
+        self.lastId = 0
+        self.lock = threading.RLock()
+        pl.reservations = self
+        if pl.metrics is not None:
+            pl.metrics.instrumentReservations(pl)
+
+    def slot(self, at: datetime.datetime):
+        return int(at.timestamp() // self.slotSeconds)
+
+    def slotStart(self, slot: int):
+        return datetime.datetime.fromtimestamp(slot * self.slotSeconds)
+
+    def window(self, start: datetime.datetime, end: datetime.datetime):
+        #Slot range covering [start, end), rounded outwards.
+        first = self.slot(start)
+        last = -(-int(end.timestamp()) // self.slotSeconds)
+        return first, max(last, first + 1)
+
+    def reserved(self, fl: int, se: int, first: int, last: int):
+        masks = self.slotMasks.get((fl, se))
+        if not masks:
+            return 0
+        union = 0
+        for slot in range(first, last):
+            union |= masks.get(slot, 0)
+        return union
+
+    def spotIsFree(self, fl: int, se: int, sp: int, start: datetime.datetime, end: datetime.datetime):
+        #Binary search in the spot's timeline for an interval overlapping [start, end).
+        timeline = self.timelines.get((fl, se, sp))
+        if not timeline:
+            return True
+        i = bisect.bisect_left(timeline, (end,))
+        return i == 0 or timeline[i - 1][1] <= start
+
+    def find(self, vehicleType, start: datetime.datetime, end: datetime.datetime, maxFloor: int = None):
+        #Returns (floor, section, spot) indexes of a spot free for the whole window on floor <= maxFloor
+        #(1-based), or None. Floors are tried nearest first; within a section the highest free spot is
+        #taken, away from where walk-ins are placed. If the window is about to start, the spot must also
+        #be free right now.
+        vehType = VehicleType(vehicleType)
+        first, last = self.window(start, end)
+        numFloors = len(self.pl.floors) if maxFloor is None else min(maxFloor, len(self.pl.floors))
+        now = start - self.leadTime <= self.pl.clock()
+        allocator = self.pl.allocator
+        with self.lock:
+            for fl in range(numFloors):
+                if not allocator.active[fl]:
+                    continue
+                for se, section in enumerate(self.pl.floors[fl].sections):
+                    if section.vehicleType != vehType:
+                        continue
+                    free = ((1 << len(section.spots)) - 1) & ~self.reserved(fl, se, first, last)
+                    if now:
+                        free &= allocator.spotMasks[fl][se]
+                    if free:
+                        return fl, se, highestBit(free)
+        return None
+
+    def book(self, vehicleType, start: datetime.datetime, end: datetime.datetime, maxFloor: int = None, spot: str = None):
+        #Books a spot (any suitable one, or the given spot code) for [start, end). Returns the Reservation
+        #or None if nothing is available.
+        vehType = VehicleType(vehicleType)
+        if end <= start:
+            return None
+        first, last = self.window(start, end)
+        start, end = self.slotStart(first), self.slotStart(last)
+        with self.lock:
+            if spot is None:
+                found = self.find(vehType, start, end, maxFloor)
+                if found is None:
+                    return None
+                fl, se, sp = found
+            else:
+                code = parseSpotCode(spot)
+                if code is None or self.pl.checkSpotCode(spot, vehType) not in (GateStatus.OK, GateStatus.SPOT_OCCUPIED):
+                    return None
+                fl, se, sp = code
+                if not self.spotIsFree(fl, se, sp, start, end):
+                    return None
+                if start - self.leadTime <= self.pl.clock() and not (self.pl.allocator.spotMasks[fl][se] >> sp) & 1:
+                    return None
+            self.lastId += 1
+            reservation = Reservation(self.lastId, vehType, fl, se, sp, start, end)
+            self.reservations[reservation.id] = reservation
+            self.index(reservation)
+            heapq.heappush(self.holds, (start - self.leadTime, reservation.id))
+            heapq.heappush(self.expiries, (end, reservation.id))
+            self.advance(self.pl.clock())
+        return reservation
+
+    def index(self, reservation: Reservation):
+        #Caller holds self.lock.
+        fl, se, sp = reservation.fl, reservation.se, reservation.sp
+        bisect.insort(self.timelines.setdefault((fl, se, sp), []), (reservation.start, reservation.end, reservation.id))
+        masks = self.slotMasks.setdefault((fl, se), {})
+        first, last = self.window(reservation.start, reservation.end)
+        for slot in range(first, last):
+            masks[slot] = masks.get(slot, 0) | 1 << sp
+
+    def unindex(self, reservation: Reservation):
+        #Caller holds self.lock.
+        fl, se, sp = reservation.fl, reservation.se, reservation.sp
+        timeline = self.timelines.get((fl, se, sp))
+        if timeline is not None:
+            entry = (reservation.start, reservation.end, reservation.id)
+            i = bisect.bisect_left(timeline, entry)
+            if i < len(timeline) and timeline[i] == entry:
+                del timeline[i]
+            if not timeline:
+                del self.timelines[(fl, se, sp)]
+        masks = self.slotMasks.get((fl, se), {})
+        first, last = self.window(reservation.start, reservation.end)
+        for slot in range(first, last):
+            mask = masks.get(slot, 0) & ~(1 << sp)
+            if mask:
+                masks[slot] = mask
+            else:
+                masks.pop(slot, None)
+
+    def spot(self, reservation: Reservation):
+        return self.pl.floors[reservation.fl].sections[reservation.se].spots[reservation.sp]
+
+    def hold(self, reservation: Reservation):
+        #Caller holds self.lock. Claims the reserved spot, moving the reservation if a car is still there.
+        if self.pl.allocator.claim(reservation.fl, reservation.se, reservation.sp, reservation.vehicleType):
+            reservation.status = ReservationStatus.HELD
+            return True
+        #Back-to-back bookings: the spot is still held by the previous reservation, so wait for its end.
+        timeline = self.timelines[(reservation.fl, reservation.se, reservation.sp)]
+        i = bisect.bisect_left(timeline, (reservation.start, reservation.end, reservation.id))
+        if i > 0:
+            previous = self.reservations.get(timeline[i - 1][2])
+            if previous is not None and previous.status in (ReservationStatus.HELD, ReservationStatus.CHECKED_IN):
+                heapq.heappush(self.holds, (previous.end, reservation.id))
+                return True
+        self.unindex(reservation)
+        found = self.find(reservation.vehicleType, reservation.start, reservation.end)
+        if found is not None and self.pl.allocator.claim(*found, reservation.vehicleType):
+            reservation.fl, reservation.se, reservation.sp = found
+            self.index(reservation)
+            reservation.status = ReservationStatus.HELD
+            return True
+        reservation.status = ReservationStatus.UNAVAILABLE
+        return False
+
+    def advance(self, now: datetime.datetime):
+        #Holds reservations that are about to start and ends the ones whose window has passed.
+        #Called by the lot on every gate operation; does nothing unless one of the heaps is due.
+        if not ((self.holds and self.holds[0][0] <= now) or (self.expiries and self.expiries[0][0] <= now)):
+            return
+        with self.lock:
+            while True:
+                #Both heaps are replayed in time order, ends first, so a spot is given back before the
+                #next reservation on it is held.
+                nextHold = self.holds[0][0] if self.holds and self.holds[0][0] <= now else None
+                nextExpiry = self.expiries[0][0] if self.expiries and self.expiries[0][0] <= now else None
+                if nextHold is None and nextExpiry is None:
+                    break
+                if nextExpiry is None or (nextHold is not None and nextHold < nextExpiry):
+                    at, ident = heapq.heappop(self.holds)
+                    reservation = self.reservations.get(ident)
+                    if reservation is not None and reservation.status == ReservationStatus.BOOKED:
+                        self.hold(reservation)
+                    continue
+                at, ident = heapq.heappop(self.expiries)
+                reservation = self.reservations.pop(ident, None)
+                if reservation is None:
+                    continue
+                if reservation.status == ReservationStatus.HELD:
+                    reservation.status = ReservationStatus.NO_SHOW
+                    self.pl.allocator.release(self.spot(reservation))
+                if reservation.status != ReservationStatus.UNAVAILABLE:
+                    self.unindex(reservation)
+
+    def checkIn(self, ident: int, pet: bool):
+        #Issues the ticket for a reservation at the entrance. A driver who arrives before the hold can
+        #still check in if the spot happens to be free.
+        with self.lock:
+            self.advance(self.pl.clock())
+            reservation = self.reservations.get(ident)
+            if reservation is None:
+                return EntryResult(GateStatus.NO_RESERVATION)
+            if reservation.status == ReservationStatus.BOOKED:
+                if not self.pl.allocator.claim(reservation.fl, reservation.se, reservation.sp, reservation.vehicleType):
+                    return EntryResult(GateStatus.NO_RESERVATION)
+                reservation.status = ReservationStatus.HELD
+            if reservation.status != ReservationStatus.HELD:
+                return EntryResult(GateStatus.NO_RESERVATION)
+            ticket = self.pl.openTicket(reservation.vehicleType, pet, self.spot(reservation).code(), (reservation.fl, reservation.se, reservation.sp))
+            reservation.status = ReservationStatus.CHECKED_IN
+            reservation.ticketNumber = ticket.ticketNumber
+            self.byTicket[ticket.ticketNumber] = reservation
+        return EntryResult(GateStatus.OK, ticket)
+
+    def cancel(self, ident: int):
+        with self.lock:
+            reservation = self.reservations.get(ident)
+            if reservation is None or reservation.status not in (ReservationStatus.BOOKED, ReservationStatus.HELD):
+                return False
+            if reservation.status == ReservationStatus.HELD:
+                self.pl.allocator.release(self.spot(reservation))
+            reservation.status = ReservationStatus.CANCELLED
+            self.unindex(reservation)
+            del self.reservations[ident]
+        return True
+
+    def floorRebuilt(self, fl: int):
+        #Called by the lot once floor fl has a new layout (or was removed). The spots its reservations were
+        #booked on are gone, so each one moves to a spot free for its whole window, or becomes UNAVAILABLE.
+        #Only booked ones can be there: a floor is rebuilt when nothing on it is held or parked.
+        with self.lock:
+            moved = [r for r in self.reservations.values() if r.fl == fl and r.status == ReservationStatus.BOOKED]
+            for reservation in moved:
+                self.unindex(reservation)
+            for key in [key for key in self.slotMasks if key[0] == fl]:
+                del self.slotMasks[key]
+            for key in [key for key in self.timelines if key[0] == fl]:
+                del self.timelines[key]
+            for reservation in moved:
+                found = self.find(reservation.vehicleType, reservation.start, reservation.end)
+                if found is None:
+                    reservation.status = ReservationStatus.UNAVAILABLE
+                    continue
+                reservation.fl, reservation.se, reservation.sp = found
+                self.index(reservation)
+
+    def ticketPaid(self, ticket):
+        #Called by the lot once a ticket is paid and its spot released.
+        if ticket.ticketNumber not in self.byTicket:
+            return
+        with self.lock:
+            reservation = self.byTicket.pop(ticket.ticketNumber, None)
+            if reservation is None:
+                return
+            reservation.status = ReservationStatus.COMPLETED
+            if self.reservations.pop(reservation.id, None) is not None:
+                self.unindex(reservation)
+
+    def timeline(self, spot: str):
+        #Booked (start, end, reservation id) intervals of a spot, in order.
+        code = parseSpotCode(spot)
+        if code is None:
+            return []
+        with self.lock:
+            return list(self.timelines.get(code, []))
@@ -0,0 +1,156 @@
+import contextlib
+import datetime
+import heapq
+import io
+import math
+import random
+import time
+from parkinglot import ParkingLot, VehicleType, PaymentMethod
+
+class SimulatedClock():
+    #Stands in for datetime.datetime.now: the simulator moves it forward event by event.
+    def __init__(self, start: datetime.datetime = datetime.datetime(2024, 1, 1)):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+#Arrivals per hour and mean stay in hours for each vehicle type.
+DEFAULT_ARRIVALS = {VehicleType.CAR: 30, VehicleType.TRUCK: 6, VehicleType.VAN: 8, VehicleType.MOTORCYCLE: 10}
+DEFAULT_STAYS = {VehicleType.CAR: 2.5, VehicleType.TRUCK: 1.5, VehicleType.VAN: 2, VehicleType.MOTORCYCLE: 3}
+
+class SimulatedPanel():
+    #One entrance or exit gate in simulated time. It serves one vehicle at a time for serviceSeconds;
+    #a vehicle that finds it busy queues until it is free. Keeps its own waits and call latencies.
+    def __init__(self, kind: str, ident: int, serviceSeconds: float, start: datetime.datetime):
+        self.kind = kind
+        self.id = ident
+        self.service = datetime.timedelta(seconds=serviceSeconds)
+        self.freeAt = start
+        self.served = 0
+        self.busySeconds = 0.0
+        self.waits = []
+        self.latencies = []
+
+    def enqueue(self, at: datetime.datetime):
+        #Time the vehicle arriving at `at` reaches the gate.
+        start = max(at, self.freeAt)
+        self.freeAt = start + self.service
+        self.waits.append((start - at).total_seconds())
+        self.busySeconds += self.service.total_seconds()
+        return start
+
+class Simulator():
+    #Discrete-event simulation of a lot: Poisson arrivals per vehicle type at randomly chosen entrance
+    #panels, exponential stays, and checkout at a random exit panel. Panels work concurrently in
+    #simulated time and each handles one vehicle at a time, so busy panels build queues; the ticket is
+    #issued (or paid) when the vehicle reaches the front. Everything is driven by one seeded Random and a
+    #SimulatedClock, so the same seed always produces the same day. Wall-clock latencies of the library
+    #calls are sampled on the side, overall and per panel.
+    def __init__(self, pl: ParkingLot, clock: SimulatedClock, seed: int = 1, arrivals: dict = None, stays: dict = None, numPanels: int = 10, boardEvery: int = 100, entranceSeconds: float = 15, exitSeconds: float = 30):
+        self.pl = pl
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.arrivals = arrivals if arrivals is not None else DEFAULT_ARRIVALS
+        self.stays = stays if stays is not None else DEFAULT_STAYS
+        self.numPanels = numPanels
+        self.boardEvery = boardEvery
+        self.events = []
+        self.sequence = 0
+        self.latencies = {"issue": [], "lookup": [], "checkout": [], "board": []}
+        self.entrancePanels = [SimulatedPanel("entrance", i + 1, entranceSeconds, clock.now) for i in range(numPanels)]
+        self.exitPanels = [SimulatedPanel("exit", i + 1, exitSeconds, clock.now) for i in range(numPanels)]
+        self.arrived = 0
+        self.rejected = 0
+        self.departed = 0
+        self.revenue = 0.0
+
+    def schedule(self, at: datetime.datetime, kind: str, data):
+        self.sequence += 1
+        heapq.heappush(self.events, (at, self.sequence, kind, data))
+
+    def nextArrival(self, vehType: VehicleType):
+        hours = self.rng.expovariate(self.arrivals[vehType])
+        self.schedule(self.clock.now + datetime.timedelta(hours=hours), "arrival", vehType)
+
+    def prefill(self, fraction: float):
+        #Parks vehicles right away so large lots start near a realistic occupancy.
+        for vehType in VehicleType:
+            for i in range(int(self.pl.freeSpots(vehType) * fraction)):
+                result = self.pl.issueTicket(vehType, False)
+                stay = self.rng.expovariate(1 / self.stays[vehType])
+                self.schedule(self.clock.now + datetime.timedelta(hours=stay), "departure", result.ticket.ticketNumber)
+
+    def run(self, duration: datetime.timedelta, maxEvents: int = None):
+        self.started = self.clock.now
+        end = self.clock.now + duration
+        for vehType in VehicleType:
+            if self.arrivals.get(vehType, 0) > 0:
+                self.nextArrival(vehType)
+        board = self.pl.parkingDisplayBoards[0]
+        handled = 0
+        while self.events and self.events[0][0] <= end:
+            if maxEvents is not None and handled >= maxEvents:
+                break
+            at, sequence, kind, data = heapq.heappop(self.events)
+            self.clock.now = at
+            if kind == "arrival":
+                self.arrived += 1
+                panel = self.entrancePanels[self.rng.randrange(self.numPanels)]
+                self.schedule(panel.enqueue(at), "issue", (data, panel))
+                self.nextArrival(data)
+            elif kind == "departure":
+                panel = self.exitPanels[self.rng.randrange(self.numPanels)]
+                self.schedule(panel.enqueue(at), "checkout", (data, panel))
+            elif kind == "issue":
+                vehType, panel = data
+                start = time.perf_counter()
+                result = self.pl.issueTicket(vehType, self.rng.random() < 0.1)
+                elapsed = time.perf_counter() - start
+                self.latencies["issue"].append(elapsed)
+                panel.latencies.append(elapsed)
+                panel.served += 1
+                if result.ok:
+                    stay = self.rng.expovariate(1 / self.stays[vehType])
+                    self.schedule(at + datetime.timedelta(hours=stay), "departure", result.ticket.ticketNumber)
+                else:
+                    self.rejected += 1
+            else:
+                ticketNumber, panel = data
+                start = time.perf_counter()
+                self.pl.tickets.get(ticketNumber)
+                self.latencies["lookup"].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                result = self.pl.checkout(ticketNumber, PaymentMethod(self.rng.randint(1, 2)))
+                elapsed = time.perf_counter() - start
+                self.latencies["checkout"].append(elapsed)
+                panel.latencies.append(elapsed)
+                panel.served += 1
+                if result.ok:
+                    self.departed += 1
+                    self.revenue += result.amount
+            handled += 1
+            if self.boardEvery and handled % self.boardEvery == 0:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    board.printParkingLot()
+                self.latencies["board"].append(time.perf_counter() - start)
+        return handled
+
+def panelsFor(arrivals: dict, exitSeconds: float = 30, busy: float = 0.7):
+    #Enough panels for the exits (the slower gates) to run at about `busy` of their capacity.
+    return max(2, math.ceil(sum(arrivals.values()) * exitSeconds / 3600 / busy))
+
+def simulate(numSpots: int, duration: datetime.timedelta = datetime.timedelta(days=7), seed: int = 1, maxEvents: int = None, prefill: float = 0.5):
+    #Builds a lot of about numSpots spots (4 sections per floor), scales arrivals so the lot stays busy
+    #and runs the simulation. Returns the Simulator with its counters and latency samples.
+    spotsPerSection = 10 if numSpots <= 200 else 100 if numSpots <= 100000 else 1000
+    numFloors = max(1, numSpots // (4 * spotsPerSection))
+    clock = SimulatedClock()
+    pl = ParkingLot("Simulation", "admin", "admin", numFloors=numFloors, spotsPerSection=spotsPerSection, maxFloors=numFloors, compact=numSpots > 10000, clock=clock)
+    scale = pl.totalSpots / 200
+    arrivals = {vt: rate * scale for vt, rate in DEFAULT_ARRIVALS.items()}
+    simulator = Simulator(pl, clock, seed, arrivals, numPanels=panelsFor(arrivals))
+    simulator.prefill(prefill)
+    simulator.run(duration, maxEvents)
+    return simulator
@@ -0,0 +1,233 @@
+import contextlib
+import queue
+import sqlite3
+import threading
+from parkinglot import ParkingTicket, PaymentStatus
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    ticketNumber INTEGER PRIMARY KEY,
+    vehicleType INTEGER NOT NULL,
+    pet INTEGER NOT NULL,
+    spot TEXT NOT NULL,
+    issuedAt REAL NOT NULL,
+    additionalFee INTEGER NOT NULL,
+    paidAt REAL,
+    payAmount REAL NOT NULL,
+    payStatus TEXT NOT NULL,
+    priceFactor REAL NOT NULL DEFAULT 1,
+    payMethod INTEGER
+);
+CREATE INDEX IF NOT EXISTS ticketsByStatus ON tickets (payStatus);
+CREATE INDEX IF NOT EXISTS ticketsByIssued ON tickets (issuedAt, ticketNumber);
+CREATE INDEX IF NOT EXISTS ticketsByPaid ON tickets (paidAt) WHERE paidAt IS NOT NULL;
+"""
+
+#Column order matches ParkingTicket.restore.
+COLUMNS = "ticketNumber, vehicleType, pet, spot, issuedAt, additionalFee, paidAt, payAmount, priceFactor, payStatus, payMethod"
+
+class SQLiteTicketStore():
+    #SQLite backend with the same methods as parkinglot.TicketStore. Open tickets stay in memory as live
+    #objects so the gate hot path never touches the database; paid tickets are read back on demand.
+    #All writes go through one connection and are group-committed: rows queue up and are written in one
+    #transaction every batchSize changes or every commitInterval seconds, and before any query that needs
+    #them. Reads use a pool of connections, which WAL mode lets run alongside the writer.
+    def __init__(self, path: str, batchSize: int = 500, commitInterval: float = 0.05, readers: int = 4, writeTimeout: float = 0.1):
+        self.path = path
+        self.batchSize = batchSize
+        self.commitInterval = commitInterval
+        #A short busy timeout: a locked database fails the flush fast and the rows wait for the next one.
+        self.writer = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=writeTimeout)
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        self.writer.execute("PRAGMA synchronous=NORMAL")
+        self.writer.executescript(SCHEMA)
+        #Databases created before price factors existed get the column, with every old ticket at factor 1.
+        #Likewise payment methods, unknown (NULL) for tickets paid before.
+        columns = [row[1] for row in self.writer.execute("PRAGMA table_info(tickets)")]
+        if "priceFactor" not in columns:
+            self.writer.execute("ALTER TABLE tickets ADD COLUMN priceFactor REAL NOT NULL DEFAULT 1")
+        if "payMethod" not in columns:
+            self.writer.execute("ALTER TABLE tickets ADD COLUMN payMethod INTEGER")
+        self.writeLock = threading.Lock()
+        self.readers = queue.Queue()
+        for i in range(readers):
+            connection = sqlite3.connect(path, check_same_thread=False)
+            connection.execute("PRAGMA query_only=ON")
+            self.readers.put(connection)
+        self.lock = threading.Lock()
+        self.pending = []
+        self.openTickets = {}
+        #Numbers of open tickets a gate is charging right now (see TicketStore.claim).
+        self.claimed = set()
+        with self.reader() as connection:
+            for row in connection.execute(f"SELECT {COLUMNS} FROM tickets WHERE payStatus = ?", (PaymentStatus(1).name,)):
+                ticket = ParkingTicket.restore(*row)
+                self.openTickets[ticket.ticketNumber] = ticket
+        self.closed = threading.Event()
+        self.full = threading.Event()
+        self.flusher = threading.Thread(target=self.flushLoop, daemon=True)
+        self.flusher.start()
+
+    @contextlib.contextmanager
+    def reader(self):
+        connection = self.readers.get()
+        try:
+            yield connection
+        finally:
+            self.readers.put(connection)
+
+    def row(self, ticket):
+        paidAt = ticket.paidAtDate.timestamp() if ticket.paidAtDate != "" else None
+        return (ticket.ticketNumber, ticket.vehicleType.value, ticket.pet, ticket.spot, ticket.issuedAtDate.timestamp(), ticket.additionalFee, paidAt, ticket.payAmount, ticket.priceFactor, ticket.payStatus, ticket.payMethod.value if ticket.payMethod is not None else None)
+
+    def queueWrite(self, ticket):
+        #Caller holds self.lock, so this only queues the row. A full batch wakes the flusher instead of
+        #being written here; gates never wait on the database.
+        self.pending.append(self.row(ticket))
+        if len(self.pending) >= self.batchSize:
+            self.full.set()
+
+    def flush(self):
+        #The queue is swapped out under self.lock and written under writeLock only, so claim/add/archive
+        #carry on while the transaction runs. writeLock also keeps batches in order. If the database cannot
+        #be written right now (locked, disk full, gone), the rows go back in front of the queue for the next try.
+        with self.writeLock:
+            with self.lock:
+                rows = self.pending
+                self.pending = []
+            if not rows:
+                return
+            try:
+                self.writer.execute("BEGIN")
+                self.writer.executemany(f"INSERT OR REPLACE INTO tickets ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.writer.execute("COMMIT")
+            except sqlite3.Error:
+                if self.writer.in_transaction:
+                    self.writer.execute("ROLLBACK")
+                with self.lock:
+                    self.pending = rows + self.pending
+                raise
+
+    def flushLoop(self):
+        while not self.closed.is_set():
+            self.full.wait(self.commitInterval)
+            self.full.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
+
+    def query(self, sql: str, params: tuple = ()):
+        #Runs a read after committing everything queued, so callers see their own writes.
+        self.flush()
+        with self.reader() as connection:
+            rows = connection.execute(sql, params).fetchall()
+        return [self.openTickets.get(row[0]) or ParkingTicket.restore(*row) for row in rows]
+
+    def add(self, ticket):
+        with self.lock:
+            self.openTickets[ticket.ticketNumber] = ticket
+            self.queueWrite(ticket)
+
+    def get(self, ticketNumber: int):
+        ticket = self.openTickets.get(ticketNumber)
+        if ticket is None:
+            found = self.query(f"SELECT {COLUMNS} FROM tickets WHERE ticketNumber = ?", (ticketNumber,))
+            if found:
+                ticket = found[0]
+        return ticket
+
+    def getOpen(self, ticketNumber: int):
+        return self.openTickets.get(ticketNumber)
+
+    def claim(self, ticketNumber: int):
+        with self.lock:
+            ticket = self.openTickets.get(ticketNumber)
+            if ticket is None or ticketNumber in self.claimed:
+                return None
+            self.claimed.add(ticketNumber)
+            return ticket
+
+    def unclaim(self, ticket):
+        with self.lock:
+            self.claimed.discard(ticket.ticketNumber)
+
+    def archive(self, ticket, paidAtDate):
+        #The paid row itself is written by update() once the lot has filled in the payment.
+        with self.lock:
+            if self.openTickets.pop(ticket.ticketNumber, None) is None:
+                return False
+            self.claimed.discard(ticket.ticketNumber)
+        return True
+
+    def update(self, ticket):
+        with self.lock:
+            self.queueWrite(ticket)
+
+    def load(self, tickets):
+        unpaid = PaymentStatus(1).name
+        with self.lock:
+            for ticket in tickets:
+                if ticket.payStatus == unpaid:
+                    self.openTickets[ticket.ticketNumber] = ticket
+                self.pending.append(self.row(ticket))
+        self.flush()
+
+    def unpaid(self):
+        return list(self.openTickets.values())
+
+    def maxTicketNumber(self):
+        self.flush()
+        with self.reader() as connection:
+            return connection.execute("SELECT COALESCE(MAX(ticketNumber), 0) FROM tickets").fetchone()[0]
+
+    def page(self, offset: int, limit: int):
+        return self.query(f"SELECT {COLUMNS} FROM tickets ORDER BY issuedAt, ticketNumber LIMIT ? OFFSET ?", (limit, offset))
+
+    def issuedBetween(self, start, end):
+        return self.query(f"SELECT {COLUMNS} FROM tickets WHERE issuedAt >= ? AND issuedAt < ? ORDER BY issuedAt, ticketNumber", (start.timestamp(), end.timestamp()))
+
+    def paidBetween(self, start, end):
+        return self.query(f"SELECT {COLUMNS} FROM tickets WHERE paidAt >= ? AND paidAt < ? ORDER BY paidAt, ticketNumber", (start.timestamp(), end.timestamp()))
+
+    def numOpen(self):
+        return len(self.openTickets)
+
+    def __len__(self):
+        self.flush()
+        with self.reader() as connection:
+            return connection.execute("SELECT COUNT(*) FROM tickets").fetchone()[0]
+
+    def scan(self, start=None, end=None, chunkSize: int = 1000):
+        #Tickets issued in [start, end) in issue order, chunkSize at a time, fetched by key rather than by offset.
+        last = (float("-inf") if start is None else start.timestamp(), 0)
+        limit = float("inf") if end is None else end.timestamp()
+        while True:
+            found = self.query(f"SELECT {COLUMNS} FROM tickets WHERE (issuedAt, ticketNumber) > (?, ?) AND issuedAt < ? ORDER BY issuedAt, ticketNumber LIMIT ?", (*last, limit, chunkSize))
+            if not found:
+                return
+            yield found
+            if len(found) < chunkSize:
+                return
+            last = (found[-1].issuedAtDate.timestamp(), found[-1].ticketNumber)
+
+    def __iter__(self):
+        for chunk in self.scan():
+            yield from chunk
+
+    def __getitem__(self, position: int):
+        if position < 0:
+            position += len(self)
+        found = self.page(position, 1)
+        if not found:
+            raise IndexError("ticket position out of range")
+        return found[0]
+
+    def close(self):
+        self.closed.set()
+        self.full.set()
+        self.flusher.join()
+        self.flush()
+        while not self.readers.empty():
+            self.readers.get().close()
+        self.writer.close()
@@ -0,0 +1,52 @@
+import json
+from parkinglot import ParkingLot, normalizeLayout, defaultLayout
+
+#A lot's layout as a JSON config file, e.g.
+#{
+#    "maxFloors": 40,
+#    "panels": 10,
+#    "panelsPerFloor": 2,
+#    "floorLayout": [["CAR", 120], ["TRUCK", 20], ["VAN", 30], ["MOTORCYCLE", 60]],
+#    "floors": [null, null, [["CAR", 200], ["CAR", 200], ["MOTORCYCLE", 80]], []]
+#}
+#Each entry of "floors" is one floor: a list of [vehicle type, spots] sections lettered A, B, ... in
+#order, null for floorLayout, or [] for a floor that is not in use. "numFloors": n can be given instead
+#of "floors" for n floors of floorLayout.
+
+class Topology():
+    def __init__(self, floorLayout=defaultLayout(10), floors=None, numFloors: int = 5, maxFloors: int = None, panels: int = 10, panelsPerFloor: int = 2):
+        self.floorLayout = normalizeLayout(floorLayout)
+        if floors is None:
+            floors = [None] * numFloors
+        self.floors = [self.floorLayout if layout is None else normalizeLayout(layout) for layout in floors]
+        self.maxFloors = maxFloors if maxFloors is not None else max(len(self.floors), 9)
+        self.panels = panels
+        self.panelsPerFloor = panelsPerFloor
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            config = json.load(f)
+        return cls(config.get("floorLayout", defaultLayout(10)), config.get("floors"), config.get("numFloors", 5), config.get("maxFloors"), config.get("panels", 10), config.get("panelsPerFloor", 2))
+
+    def build(self, loc: str, admin: str, password: str, **kwargs):
+        #A new lot with this topology; other ParkingLot arguments (compact, ticketStore, clock, ...) pass through.
+        pl = ParkingLot(loc, admin, password, numFloors=len(self.floors), maxFloors=self.maxFloors, layout=self.floorLayout, panels=self.panels, panelsPerFloor=self.panelsPerFloor, **kwargs)
+        self.apply(pl)
+        return pl
+
+    def apply(self, pl: ParkingLot):
+        #Brings a running lot to this topology, floor by floor, through setFloorLayout: floors are added
+        #or grown at once, floors that shrink, change or go away are drained first. Floors the config does
+        #not list are removed. Returns {floor number: vehicles still to leave} for the floors still
+        #draining, and None for the floors that could not be changed (maxFloors).
+        pl.maxFloors = self.maxFloors
+        pl.floorLayout = self.floorLayout
+        pl.panelsPerFloor = self.panelsPerFloor
+        pending = {}
+        for fl in range(max(len(self.floors), len(pl.floors))):
+            layout = self.floors[fl] if fl < len(self.floors) else ()
+            remaining = pl.setFloorLayout(fl + 1, layout)
+            if remaining != 0:
+                pending[fl + 1] = remaining
+        return pending